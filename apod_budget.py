@@ -0,0 +1,171 @@
+'''
+apod_budget.py keeps track of how many calls the APOD api will still accept.
+
+api.nasa.gov allows every api key a number of calls per rolling hour (1000 for a personal key,
+far fewer for DEMO_KEY) and reports what is left in the X-RateLimit-Remaining header of every
+response. Once a key runs out, every call fails with a 429 until the hour has passed.
+
+RateBudget follows the remaining calls of every configured key. Calls are admitted by priority:
+interactive calls, made while a visitor waits for a page, may use the whole budget. Background
+calls (refreshing todays image, prefetching) are refused once the budget drops below a reserve,
+so visitors are never refused because a background thread used up the last calls. When several
+keys are configured (NASA_KEYS in nasa_key.py) every call goes to the key with the most calls left.
+
+When a call is refused nasa_api.py serves what it has locally instead, see getRandomImages.
+
+With several worker processes (see apod_server.py) every worker spends the same rate limit.
+Given an APODCache the remaining calls are kept in its SQLite database and every worker reads
+and counts them under a write lock, otherwise every worker would start out assuming the whole
+limit and its background calls could eat into the reserve kept for visitors.
+'''
+
+# built in imports
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+# Non built in imports
+import requests as reqs
+
+# call priorities, interactive calls are admitted before background calls
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# the hourly limit of a personal api.nasa.gov key, used until the api reports the real limit
+DEFAULT_LIMIT = 1000
+
+
+def keyHash(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class BudgetExhausted(reqs.RequestException):
+    ''' Raised instead of making a call the budget can not afford. It is a RequestException
+    so every caller already handling a failed api call handles it as well '''
+
+
+class KeyBudget():
+    ''' Remaining calls of one api key '''
+    __slots__ = ('key', 'limit', 'remaining', 'updated')
+
+    def __init__(self, key, limit):
+        self.key = key
+        self.limit = limit
+        self.remaining = limit
+        self.updated = 0.0  # <- time the api last reported the remaining calls or of the first call counted since
+
+
+class RateBudget():
+    '''Admission of api calls by priority within the rate limit of one or more api keys
+
+    use:
+        budget = RateBudget(['key one', 'key two'])
+        api_key = budget.acquire(BACKGROUND)  # <- None if the call should not be made
+        ... make the call with api_key ...
+        budget.update(api_key, response.status_code, response.headers)
+
+    parameters:
+        keys: api keys to spread the calls over
+        cache: APODCache whose database holds the remaining calls shared by every process,
+               None to follow them in this process only
+        limit: calls per window assumed until the api reports its limit
+        window: seconds after which a key the api has not reported on since is assumed to be refilled
+        background_reserve: share of the limit kept for interactive calls, background calls are
+                            refused once fewer calls than this are left
+    '''
+    def __init__(self, keys, cache=None, limit=DEFAULT_LIMIT, window=3600, background_reserve=0.2):
+        self.cache = cache
+        self.window = window
+        self.background_reserve = background_reserve
+        self.budgets = [KeyBudget(key, limit) for key in dict.fromkeys(keys)]  # <- drop duplicate keys
+        self.refused = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._lock = threading.Lock()
+        if cache is not None:
+            db = cache.connect()
+            with db:
+                # keys are stored as a hash, the database file does not need to be kept secret
+                db.execute('''CREATE TABLE IF NOT EXISTS budget (
+                                  key_hash TEXT PRIMARY KEY,
+                                  rate_limit INTEGER NOT NULL,
+                                  remaining INTEGER NOT NULL,
+                                  updated REAL NOT NULL)''')
+
+    @contextmanager
+    def _shared(self, write=False):
+        '''
+        Hold the lock over the budgets. With a cache the budgets are first read from its database,
+        and with write=True written back in the same transaction, so processes never overdraw them
+        '''
+        with self._lock:
+            if self.cache is None:
+                yield
+                return
+            db = self.cache.connect()
+            with db:
+                if write:
+                    db.execute('BEGIN IMMEDIATE')
+                stored = {row[0]: row[1:] for row in db.execute('SELECT * FROM budget')}
+                for budget in self.budgets:
+                    if keyHash(budget.key) in stored:
+                        budget.limit, budget.remaining, budget.updated = stored[keyHash(budget.key)]
+                yield
+                if write:
+                    db.executemany('INSERT OR REPLACE INTO budget VALUES (?, ?, ?, ?)',
+                                   [(keyHash(budget.key), budget.limit, budget.remaining, budget.updated)
+                                    for budget in self.budgets])
+
+    def _refill(self, now):
+        for budget in self.budgets:
+            if budget.updated and now - budget.updated >= self.window:
+                budget.remaining = budget.limit
+                budget.updated = 0.0
+
+    def _floor(self, budget, priority):
+        ''' Calls that must be left on budget after a call of priority '''
+        return 0 if priority == INTERACTIVE else budget.limit * self.background_reserve
+
+    def allows(self, priority=INTERACTIVE):
+        ''' True if a call of priority would be admitted right now. Does not use up a call '''
+        with self._shared():
+            self._refill(time.time())
+            return any(budget.remaining > self._floor(budget, priority) for budget in self.budgets)
+
+    def acquire(self, priority=INTERACTIVE):
+        '''
+        Return the api key to make a call with, or None if the call should not be made.
+        The call is counted straight away so concurrent callers do not overdraw the budget
+        '''
+        with self._shared(write=True):
+            self._refill(time.time())
+            budget = max(self.budgets, key=lambda budget: budget.remaining)
+            if budget.remaining <= self._floor(budget, priority):
+                self.refused[priority] += 1
+                return None
+            budget.remaining -= 1
+            budget.updated = budget.updated or time.time()
+            return budget.key
+
+    def update(self, key, status, headers):
+        ''' Record what the api reported for a call made with key '''
+        remaining, limit = headers.get('X-RateLimit-Remaining'), headers.get('X-RateLimit-Limit')
+        with self._shared(write=True):
+            budget = next((budget for budget in self.budgets if budget.key == key), None)
+            if budget is None:
+                return
+            try:
+                if limit is not None:
+                    budget.limit = int(limit)
+                if remaining is not None:
+                    budget.remaining = int(remaining)
+            except ValueError:
+                pass  # <- a garbled header, keep counting ourselves
+            if status == 429:
+                budget.remaining = 0  # <- out of calls whatever the headers say
+            budget.updated = time.time()
+
+    def remaining(self):
+        ''' Estimated calls left over all keys '''
+        with self._shared():
+            self._refill(time.time())
+            return sum(max(budget.remaining, 0) for budget in self.budgets)
@@ -0,0 +1,178 @@
+'''
+apod_cache.py provides a persistent, date keyed cache for the records returned by the
+NASA astronomy picture of the day api.
+
+A record for a past date never changes once it has been published, so there is no reason
+to ask NASA for it more than once. Records are kept in a small SQLite database on local disk
+with an in-process LRU in front of it so repeated page views never leave the process.
+Records for past dates never expire. Records for today (or later) are only kept for a short
+time to live because the record may still change shortly after it is published.
+
+The cache stores the raw JSON dict returned by the api, NASAImage objects are built
+from the cached record by the caller.
+'''
+
+# built in imports
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# default time to live in seconds for records dated today or later
+TODAY_TTL = 300
+
+
+def isCacheable(record):
+    ''' Only real records are cached. Error responses from the api and the ERROR_IMAGE
+    replacement do not have a date key of their own or are not a dict at all '''
+    return isinstance(record, dict) and 'date' in record and 'title' in record
+
+
+class APODCache():
+    '''Date keyed cache for APOD records backed by SQLite with an in-process LRU in front
+
+    use:
+        cache = APODCache('apod_cache.sqlite3')
+        cache.put(record)
+        record = cache.get('2021-03-13')  # None on a miss
+
+    parameters:
+        path: location of the SQLite database file. ':memory:' is not shared between threads
+        lru_size: maximum number of records held in memory
+        today_ttl: seconds a record dated today or later is considered fresh
+    '''
+    def __init__(self, path='apod_cache.sqlite3', lru_size=512, today_ttl=TODAY_TTL):
+        self.path = path
+        self.lru_size = lru_size
+        self.today_ttl = today_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()  # <- apod date: (expires, record), expires is None for past dates
+        self._lock = threading.Lock()
+        self._local = threading.local()  # <- sqlite connections can not be shared between threads
+        db = self.connect()
+        with db:
+            db.execute('''CREATE TABLE IF NOT EXISTS records (
+                              date TEXT PRIMARY KEY,
+                              media_type TEXT,
+                              expires REAL,
+                              record TEXT NOT NULL)''')
+            # past dates the api has no record for, APOD skipped a few days in its early years
+            db.execute('CREATE TABLE IF NOT EXISTS gaps (date TEXT PRIMARY KEY)')
+
+    def connect(self):
+        ''' Return the SQLite connection for the calling thread, opening it on first use '''
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            # write ahead logging lets readers carry on while another thread or process writes
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _expires(self, apod_date):
+        ''' Past dates never expire, today and later get a short time to live '''
+        if apod_date < datetime.today().date().strftime('%Y-%m-%d'):
+            return None
+        return time.time() + self.today_ttl
+
+    def _remember(self, apod_date, expires, record):
+        ''' Add a record to the in-process LRU, evicting the least recently used if full '''
+        with self._lock:
+            self._lru[apod_date] = (expires, record)
+            self._lru.move_to_end(apod_date)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, apod_date):
+        ''' Return the cached record for apod_date or None if it is not cached or has expired '''
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(apod_date)
+            if entry is not None:
+                if entry[0] is None or entry[0] > now:
+                    self._lru.move_to_end(apod_date)
+                    self.hits += 1
+                    return entry[1]
+                del self._lru[apod_date]
+
+        row = self.connect().execute('SELECT expires, record FROM records WHERE date = ?',
+                                      (apod_date,)).fetchone()
+        if row is None or (row[0] is not None and row[0] <= now):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        record = json.loads(row[1])
+        self._remember(apod_date, row[0], record)
+        with self._lock:
+            self.hits += 1
+        return record
+
+    def put(self, record):
+        ''' Store a single record. Records that are not cacheable are ignored '''
+        self.putMany([record])
+
+    def putMany(self, records):
+        ''' Store a list of records in a single transaction. Records that are not cacheable are ignored '''
+        rows = []
+        for record in records:
+            if not isCacheable(record):
+                continue
+            expires = self._expires(record['date'])
+            rows.append((record['date'], record.get('media_type'), expires, json.dumps(record)))
+            self._remember(record['date'], expires, record)
+        if rows:
+            db = self.connect()
+            with db:
+                db.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def getRange(self, start_date, end_date):
+        ''' Return the stored records from start_date to end_date inclusive as a dict of
+        apod date: record. Dates that are not stored or have expired are left out '''
+        rows = self.connect().execute('''SELECT date, record FROM records
+                                          WHERE date BETWEEN ? AND ?
+                                          AND (expires IS NULL OR expires > ?)''',
+                                       (start_date, end_date, time.time()))
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def putGaps(self, dates):
+        ''' Remember that the api has no record for dates. Only past dates are remembered,
+        the record for today may simply not be published yet '''
+        rows = [(apod_date,) for apod_date in dates if self._expires(apod_date) is None]
+        if rows:
+            db = self.connect()
+            with db:
+                db.executemany('INSERT OR IGNORE INTO gaps VALUES (?)', rows)
+        return len(rows)
+
+    def getGaps(self, start_date, end_date):
+        ''' Return the set of dates from start_date to end_date inclusive the api has no record for '''
+        rows = self.connect().execute('SELECT date FROM gaps WHERE date BETWEEN ? AND ?', (start_date, end_date))
+        return {row[0] for row in rows}
+
+    def imageDates(self):
+        ''' Return the dates of all stored records that can be shown in the gallery,
+        records with media_type other are not compatible with the gallery and are left out '''
+        rows = self.connect().execute('''SELECT date FROM records
+                                          WHERE media_type IN ('image', 'video')
+                                          AND (expires IS NULL OR expires > ?)''', (time.time(),))
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        return self.connect().execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def stats(self):
+        ''' Return hit and miss counters for the cache '''
+        with self._lock:
+            hits, misses, in_memory = self.hits, self.misses, len(self._lru)
+        lookups = hits + misses
+        return {'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / lookups if lookups else 0.0,
+                'in_memory': in_memory,
+                'stored': len(self)}
@@ -0,0 +1,129 @@
+'''
+apod_client.py provides the http client used to talk to the APOD api.
+
+All requests go through a single requests Session so connections to api.nasa.gov are kept
+alive and reused instead of paying for a new TLS handshake on every call. Every request has
+a timeout so a hung upstream can not block a Flask worker forever, and failed connections
+or 5xx responses are retried with an exponential backoff.
+
+Concurrent requests for the same url are coalesced: the first caller makes the upstream
+call and every other caller waiting on the same url shares its result.
+
+The time spent waiting on the upstream and decoding its JSON, the status codes and the
+X-RateLimit-Remaining header of every response are recorded in apod_metrics.py.
+
+Given a RateBudget (see apod_budget.py) the client picks the api key of every call itself and
+refuses calls the remaining rate limit can not afford by raising BudgetExhausted.
+'''
+
+# built in imports
+import threading
+from concurrent.futures import Future
+
+# Non built in imports
+import requests as reqs
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from apod_image import loads
+from apod_metrics import metrics
+from apod_budget import INTERACTIVE, BudgetExhausted
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 15)
+
+
+class APODClient():
+    '''Pooled, retrying and coalescing http client for the APOD api
+
+    use:
+        client = APODClient()
+        data = client.get('https://api.nasa.gov/planetary/apod?api_key=...&date=2021-03-13')
+
+    parameters:
+        timeout: seconds to wait for the upstream, a single number or a (connect, read) tuple
+        retries: number of times a failed connection or 5xx response is retried
+        backoff: backoff factor in seconds, retries wait backoff * 2 ** (retry - 1)
+        pool_size: number of keep-alive connections held per host
+        budget: RateBudget choosing the api_key parameter of every call, None to send urls as they are
+    '''
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=3, backoff=0.5, pool_size=10, budget=None):
+        self.timeout = timeout
+        self.budget = budget
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self._inflight = {}  # <- request key: (Future shared by every caller of the same request, its priority)
+        self._lock = threading.Lock()
+
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=['GET'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = reqs.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _fetch(self, url, params, priority):
+        ''' Make the upstream call and return the JSON data as a list '''
+        if self.budget is not None:
+            api_key = self.budget.acquire(priority)
+            if api_key is None:
+                raise BudgetExhausted(f'Not enough of the api rate limit left to request {url}')
+            params = dict(params or {}, api_key=api_key)
+        with self._lock:
+            self.upstream_calls += 1
+        try:
+            with metrics.span('upstream'):
+                response = self.session.get(url, params=params, timeout=self.timeout)
+        except reqs.RequestException:
+            metrics.observeUpstream('error')  # <- no response at all, the connection failed or timed out
+            raise
+        metrics.observeUpstream(response.status_code, response.headers.get('X-RateLimit-Remaining'))
+        if self.budget is not None:
+            self.budget.update(api_key, response.status_code, response.headers)
+        response.raise_for_status()
+        with metrics.span('decode'):
+            data = loads(response.content)  # <- orjson when it is installed, see apod_image.py
+        # Individual image responses are dict, multiple image responses are a list of dict
+        return [data] if isinstance(data, dict) else data
+
+    def get(self, url, params=None, coalesce=True, priority=INTERACTIVE):
+        '''
+        Return the JSON data for url as a list. Raises requests.RequestException when the
+        upstream call fails or the budget refuses it, and ValueError when the response is not JSON.
+        Random (count=) requests should pass coalesce=False so every caller gets its own images.
+        Calls nobody is waiting for should pass priority=BACKGROUND
+        '''
+        if not coalesce:
+            return self._fetch(url, params, priority)
+
+        key = (url, tuple(sorted((params or {}).items())))
+        with self._lock:
+            inflight = self._inflight.get(key)
+            leader = inflight is None
+            if leader:
+                future = Future()
+                self._inflight[key] = (future, priority)
+            else:
+                future, leader_priority = inflight
+                self.coalesced_calls += 1
+        if not leader:
+            try:
+                return list(future.result())
+            except BudgetExhausted:
+                if priority >= leader_priority:
+                    raise
+                # the budget refused the call for the lower priority of the leader, not for this caller
+                return list(self._fetch(url, params, priority))
+
+        try:
+            data = self._fetch(url, params, priority)
+            future.set_result(data)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return list(data)
+
+    def close(self):
+        self.session.close()
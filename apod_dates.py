@@ -0,0 +1,13 @@
+'''
+apod_dates.py holds the date helpers shared by the image model and the todays image
+refresher, so neither has to import the other just for a date.
+'''
+
+# built in imports
+from datetime import date
+
+
+def currentDate():
+    ''' Return today's date as a YYYY-MM-DD string. Computed on every call so a long
+    running server follows the date as it rolls over '''
+    return date.today().strftime('%Y-%m-%d')
@@ -0,0 +1,101 @@
+'''
+apod_image.py creates object representations of individual images from the JSON data
+returned by the NASA astronomy picture of the day api.
+
+NASAImage uses __slots__ so an image holds its six fields without a per-instance __dict__,
+which matters once the whole archive (10k+ records) is held in memory. Copyright holders
+repeat across many records, their strings are interned so every image by the same
+photographer shares one string. parseImages turns a decoded JSON list, or the raw response
+bytes, into images in a single pass. Raw bytes are decoded with orjson when it is installed.
+
+Run benchmarks/bench_parse.py to measure memory use and parse time.
+'''
+
+# built in imports
+import json
+import sys
+
+from apod_dates import currentDate
+from apod_metrics import metrics
+
+# orjson is optional, it decodes APOD responses several times faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# definition of image to return when an error occurs parsing JSON data return from api
+# it has no date of its own, NASAImage dates it the day it is shown
+ERROR_IMAGE = {'media_type':'image',
+               'title':'Error: Not Found',
+               'url':'https://www.nasa.gov/sites/default/files/2cntrl_0.jpg',
+               'explanation':'We are looking hard but could not find the requested image'}
+
+COPYRIGHT_NOT_AVAILABLE = 'Not Available'
+
+
+def loads(data):
+    ''' Decode JSON bytes or str with orjson when it is installed, with the json module otherwise '''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class NASAImage():
+    '''Creates a NASA Astonomy Picture of the Day object for a single image
+
+    use:
+        NASAImage(json_data)
+
+    parameters:
+        json_data: The json data returned by NASA APOD api for a single image
+    '''
+    __slots__ = ('copyright', 'title', 'date', 'url', 'hdurl', 'explanation')
+
+    def __init__(self, json_data):
+        # medoa_type key is sometimes missing is data and sometimes datatype is other
+        # both are not compatible with the gallery. Return an error image.
+        media_type = json_data.get('media_type')
+        if media_type is None or media_type == 'other':
+            json_data = ERROR_IMAGE
+            media_type = 'image'
+
+        # copyright data is only available on some images. The same few photographers show up
+        # on many images, intern the string so they all share one copy
+        copyright = json_data.get('copyright')
+        self.copyright = COPYRIGHT_NOT_AVAILABLE if copyright is None else sys.intern(copyright)
+        self.title = json_data['title']
+        self.date = json_data['date'] if json_data is not ERROR_IMAGE else currentDate()
+        # if we get this far and the media_type is not image then it is video.
+        # videos have a thumbnail_url key that can be used inplace of url key
+        self.url = json_data['url'] if media_type == 'image' else json_data['thumbnail_url']
+        # Some responses do not include an hdurl. In these cases replace hdurl with url
+        self.hdurl = json_data.get('hdurl') or self.url
+        self.explanation = json_data['explanation']
+
+    def asDict(self):
+        ''' Return the image fields as a dict, used by the JSON api end points '''
+        return {'date': self.date,
+                'title': self.title,
+                'copyright': self.copyright,
+                'url': self.url,
+                'hdurl': self.hdurl,
+                'explanation': self.explanation}
+
+
+def parseImages(data):
+    '''
+    Return a list of NASAImage objects from the api response in a single pass.
+
+    parameters:
+        data: the raw response as bytes or str, or the already decoded JSON data.
+              A single image (dict) or a list of images are both accepted.
+              Items that are not a dict are bad JSON and are replaced with the error image
+    '''
+    if isinstance(data, (bytes, bytearray, str)):
+        with metrics.span('decode'):
+            data = loads(data)
+    if isinstance(data, dict):
+        data = [data]
+    with metrics.span('parse'):
+        return [NASAImage(item if isinstance(item, dict) else ERROR_IMAGE) for item in data]
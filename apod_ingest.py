@@ -0,0 +1,154 @@
+'''
+apod_ingest.py backfills the local APOD record cache (see apod_cache.py) with the whole
+astronomy picture of the day archive so the gallery can serve every date locally.
+
+The span between the start and end dates is split into chunks that are requested with the
+start_date and end_date api parameters. Chunks are fetched concurrently by a small pool of
+worker threads and every finished chunk is written to a checkpoint file. An interrupted run
+started again with the same checkpoint file only fetches the chunks that are still missing.
+
+use:
+    python apod_ingest.py                                   # whole archive up to today
+    python apod_ingest.py --start 2020-01-01 --end 2020-12-31 --workers 2
+    python apod_ingest.py --base-url http://localhost:8000/planetary/apod   # local stub server
+'''
+
+# built in imports
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+# Non built in imports
+from apod_client import APODClient
+from apod_cache import APODCache
+from apod_search import SearchIndex
+
+# first date available from the APOD api
+FIRST_APOD_DATE = '1995-06-16'
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def dateChunks(start, end, chunk_days):
+    '''
+    Split the dates from start to end inclusive into (start_date, end_date) pairs
+    of at most chunk_days days. Dates are returned as YYYY-MM-DD strings
+    '''
+    start = datetime.strptime(start, '%Y-%m-%d').date()
+    end = datetime.strptime(end, '%Y-%m-%d').date()
+    chunks = []
+    while start <= end:
+        chunk_end = min(start + timedelta(days=chunk_days - 1), end)
+        chunks.append((start.strftime('%Y-%m-%d'), chunk_end.strftime('%Y-%m-%d')))
+        start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+class Checkpoint():
+    '''Records which chunks have been ingested in a small JSON file
+
+    use:
+        checkpoint = Checkpoint('apod_ingest.checkpoint.json')
+        if not checkpoint.isDone(chunk): ...
+        checkpoint.markDone(chunk)
+
+    parameters:
+        path: location of the checkpoint file. It is created on the first markDone
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as checkpoint:
+                self.done = {tuple(chunk) for chunk in json.load(checkpoint)['done']}
+
+    def isDone(self, chunk):
+        return tuple(chunk) in self.done
+
+    def markDone(self, chunk):
+        ''' Add chunk to the finished chunks and write the file. The file is written to a temporary
+        file and then renamed so an interrupted write never leaves a corrupt checkpoint '''
+        self.done.add(tuple(chunk))
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint:
+            json.dump({'done': sorted(self.done)}, checkpoint)
+        os.replace(temp_path, self.path)
+
+
+def fetchChunk(client, base_url, api_key, chunk):
+    '''
+    Request all records between the chunk start and end dates. Failed connections and
+    5xx responses are retried by the client. Returns the list of records or raises the error
+    '''
+    params = {'api_key': api_key, 'start_date': chunk[0], 'end_date': chunk[1], 'thumbs': 'true'}
+    return client.get(base_url, params=params)
+
+
+def ingest(cache, checkpoint, base_url, api_key, start=FIRST_APOD_DATE, end=None,
+           chunk_days=30, workers=4, log=print):
+    '''
+    Fetch every chunk between start and end that is not in the checkpoint yet and store
+    the records in cache. Returns a tuple of (records stored, list of failed chunks)
+    '''
+    end = end or date.today().strftime('%Y-%m-%d')
+    chunks = [chunk for chunk in dateChunks(start, end, chunk_days) if not checkpoint.isDone(chunk)]
+    log(f'{len(chunks)} chunks to ingest between {start} and {end}')
+
+    stored = 0
+    failed = []
+    # keep one pooled connection per worker thread, ranges can take a while to be answered
+    client = APODClient(timeout=(3.05, 60), pool_size=workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(fetchChunk, client, base_url, api_key, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    records = future.result()
+                except Exception as error:
+                    log(f'failed {chunk[0]} to {chunk[1]}: {error}')
+                    failed.append(chunk)
+                    continue
+                # results are written from this thread only, so the store never sees concurrent writers
+                stored += cache.putMany(records)
+                checkpoint.markDone(chunk)
+                log(f'ingested {chunk[0]} to {chunk[1]} ({len(records)} records)')
+    finally:
+        client.close()
+    return stored, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backfill the local APOD record cache from the APOD api')
+    parser.add_argument('--start', default=FIRST_APOD_DATE, help='first date to ingest (YYYY-MM-DD)')
+    parser.add_argument('--end', default=None, help='last date to ingest (YYYY-MM-DD), defaults to today')
+    parser.add_argument('--chunk-days', type=int, default=30, help='number of days per range request')
+    parser.add_argument('--workers', type=int, default=4, help='number of concurrent range requests')
+    parser.add_argument('--base-url', default='https://api.nasa.gov/planetary/apod', help='APOD api url')
+    parser.add_argument('--cache', default=os.path.join(HERE, 'apod_cache.sqlite3'), help='record cache file')
+    parser.add_argument('--checkpoint', default=os.path.join(HERE, 'apod_ingest.checkpoint.json'),
+                        help='checkpoint file used to resume an interrupted run')
+    parser.add_argument('--api-key', default=None, help='api key, defaults to NASA_KEY from nasa_key.py')
+    args = parser.parse_args(argv)
+
+    api_key = args.api_key
+    if api_key is None:
+        from nasa_key import NASA_KEY
+        api_key = NASA_KEY
+
+    cache = APODCache(args.cache)
+    stored, failed = ingest(cache, Checkpoint(args.checkpoint), args.base_url, api_key,
+                            start=args.start, end=args.end, chunk_days=args.chunk_days, workers=args.workers)
+    print(f'stored {stored} records, {len(failed)} chunks failed')
+    # index the new records now instead of on the first search of the gallery
+    print(f'indexed {SearchIndex(cache).update()} records for search')
+    if failed:
+        print('run the same command again to retry the failed chunks')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
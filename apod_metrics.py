@@ -0,0 +1,202 @@
+'''
+apod_metrics.py collects timing and health metrics for the gallery and renders them in the
+Prometheus text format served on /metrics.
+
+The hot path of a request is timed in stages:
+    upstream: the http call to the APOD api (apod_client.py)
+    decode:   decoding the JSON response (apod_client.py)
+    parse:    building NASAImage objects (apod_image.py)
+    render:   rendering the gallery template (gallery.py)
+
+Every stage is timed with a span and recorded in a latency histogram labelled with the route
+being served (background threads such as the todays image refresher are labelled background),
+next to a histogram of the total time per route. Upstream status codes and the rate limit the
+APOD api reports in its X-RateLimit-Remaining header are recorded as well. Values owned by other
+objects, like the cache hit ratios, are read when /metrics is scraped.
+
+use:
+    from apod_metrics import metrics
+
+    with metrics.span('render'):
+        html = render_template(...)
+
+With several worker processes (see apod_server.py) every worker keeps its own metrics.
+'''
+
+# built in imports
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# upper bounds in seconds of the histogram buckets, the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    '''Counts of observed values per bucket, with their sum
+
+    parameters:
+        buckets: sorted upper bounds of the buckets, values above the last one go to +Inf
+    '''
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # <- last slot is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        ''' Yield the Prometheus text lines of this histogram, buckets are cumulative '''
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{name}_bucket{{{labels},le="{le}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+def escape(value):
+    ''' Escape a Prometheus label value '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics():
+    '''Request, stage and upstream metrics of one process
+
+    use:
+        metrics.beginRequest('/date')
+        with metrics.span('upstream'):
+            ...
+        stages = metrics.endRequest('/date', 200, seconds)
+        text = metrics.render()
+
+    parameters:
+        buckets: upper bounds in seconds of the latency histogram buckets
+    '''
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.requests = {}  # <- route: Histogram of the total request time
+        self.stages = {}  # <- (route, stage): Histogram of the time spent in the stage
+        self.responses = Counter()  # <- (route, status code)
+        self.upstream_responses = Counter()  # <- upstream status code, or error when there was no response
+        self.rate_limit_remaining = None
+        self._collectors = {}  # <- metric name: (description, type, function returning the value)
+        self._local = threading.local()  # <- route and stage times of the request on this thread
+        self._lock = threading.Lock()
+
+    # ------------------------------ request timing ------------------------------ #
+
+    def beginRequest(self, route):
+        ''' Spans on this thread are labelled with route until endRequest '''
+        self._local.route = route
+        self._local.stages = {}
+
+    def endRequest(self, route, status, seconds):
+        ''' Record a finished request. Returns the seconds spent per stage during the request '''
+        stages = getattr(self._local, 'stages', None) or {}
+        self._local.route = None
+        self._local.stages = None
+        with self._lock:
+            histogram = self.requests.get(route)
+            if histogram is None:
+                histogram = self.requests[route] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            self.responses[(route, status)] += 1
+        return stages
+
+    @contextmanager
+    def span(self, stage):
+        ''' Time the body of a with statement as stage '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observeStage(stage, time.perf_counter() - start)
+
+    def observeStage(self, stage, seconds):
+        route = getattr(self._local, 'route', None) or 'background'
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        with self._lock:
+            histogram = self.stages.get((route, stage))
+            if histogram is None:
+                histogram = self.stages[(route, stage)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    # ----------------------------- upstream health ------------------------------ #
+
+    def observeUpstream(self, status, rate_limit_remaining=None):
+        ''' Record the status of an APOD api response and the rate limit it reports '''
+        with self._lock:
+            self.upstream_responses[status] += 1
+            if rate_limit_remaining is not None:
+                try:
+                    self.rate_limit_remaining = int(rate_limit_remaining)
+                except ValueError:
+                    pass
+
+    def collect(self, name, description, kind, function):
+        ''' Read function() as metric name (a gauge or counter) whenever the metrics are rendered.
+        Collecting a name again replaces the previous function '''
+        self._collectors[name] = (description, kind, function)
+
+    # -------------------------------- exposition -------------------------------- #
+
+    def render(self):
+        ''' Return every metric in the Prometheus text exposition format '''
+        with self._lock:
+            requests = {route: self._copy(histogram) for route, histogram in self.requests.items()}
+            stages = {key: self._copy(histogram) for key, histogram in self.stages.items()}
+            responses = dict(self.responses)
+            upstream_responses = dict(self.upstream_responses)
+            rate_limit_remaining = self.rate_limit_remaining
+
+        lines = ['# HELP apod_request_duration_seconds Time to answer a request per route',
+                 '# TYPE apod_request_duration_seconds histogram']
+        for route, histogram in sorted(requests.items()):
+            lines.extend(histogram.samples('apod_request_duration_seconds', f'route="{escape(route)}"'))
+        lines += ['# HELP apod_stage_duration_seconds Time spent per stage of a request',
+                  '# TYPE apod_stage_duration_seconds histogram']
+        for (route, stage), histogram in sorted(stages.items()):
+            lines.extend(histogram.samples('apod_stage_duration_seconds',
+                                           f'route="{escape(route)}",stage="{escape(stage)}"'))
+        lines += ['# HELP apod_responses_total Responses sent per route and status code',
+                  '# TYPE apod_responses_total counter']
+        for (route, status), count in sorted(responses.items()):
+            lines.append(f'apod_responses_total{{route="{escape(route)}",status="{status}"}} {count}')
+        lines += ['# HELP apod_upstream_responses_total APOD api responses per status code',
+                  '# TYPE apod_upstream_responses_total counter']
+        for status, count in sorted(upstream_responses.items(), key=lambda item: str(item[0])):
+            lines.append(f'apod_upstream_responses_total{{status="{status}"}} {count}')
+        if rate_limit_remaining is not None:
+            lines += ['# HELP apod_upstream_rate_limit_remaining Requests left according to X-RateLimit-Remaining',
+                      '# TYPE apod_upstream_rate_limit_remaining gauge',
+                      f'apod_upstream_rate_limit_remaining {rate_limit_remaining}']
+        for name, (description, kind, function) in sorted(self._collectors.items()):
+            try:
+                value = function()
+            except Exception:
+                continue  # <- a broken collector should not take /metrics down with it
+            if value is None:
+                continue
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def _copy(self, histogram):
+        copy = Histogram(histogram.buckets)
+        copy.counts, copy.sum, copy.count = list(histogram.counts), histogram.sum, histogram.count
+        return copy
+
+
+# The metrics of this process, shared by every module
+metrics = Metrics()
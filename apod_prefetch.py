@@ -0,0 +1,120 @@
+'''
+apod_prefetch.py warms the days around a date a visitor looks at before they ask for them.
+
+Visitors of /date mostly step through the archive a day at a time. After every date lookup
+the date is queued, and a background thread warms the days around it: their records are stored
+in the record cache and their images resized by the image proxy. The next step is then
+answered from the local cache instead of waiting on the APOD api.
+
+The queue is bounded and newest first. When visitors browse faster than the thread can keep
+up, the oldest dates are dropped, and dates that waited longer than max_age are skipped:
+the visitor has moved on and warming them would only spend api calls.
+
+A lookup of a date that was warmed before it was asked for counts as a hit. The hit ratio
+tells whether the window (days on either side) is large enough, see /metrics.
+With several worker processes every worker counts its own hits, so the ratio is a lower bound.
+'''
+
+# built in imports
+import threading
+import time
+from collections import OrderedDict, deque
+
+# number of warmed dates remembered to count hits
+MAX_WARMED = 4096
+
+
+class Prefetcher():
+    '''Background warming of the dates around the dates visitors look at
+
+    use:
+        prefetcher = Prefetcher(warm, window=3).start()
+        prefetcher.visit('2021-03-13')  # <- count a hit or miss and queue the days around it
+
+    parameters:
+        warm: callable taking a YYYY-MM-DD date and window, warming the window days on either
+              side of it. Returns the dates it warmed
+        window: number of days on either side of a visited date to warm
+        max_queue: number of dates waiting to be warmed, the oldest are dropped beyond it
+        max_age: seconds a date may wait in the queue before it is dropped as stale
+    '''
+    def __init__(self, warm, window=3, max_queue=16, max_age=30):
+        self.warm = warm
+        self.window = window
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.queued = 0
+        self.dropped = 0
+        self.warmed_dates = 0
+        self._queue = deque(maxlen=max_queue)  # <- (date, time queued), newest on the left
+        self._queued_dates = set()
+        self._warmed = OrderedDict()  # <- dates warmed and not visited yet
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def visit(self, apod_date):
+        ''' Count whether apod_date was warmed before it was asked for and queue the days around it '''
+        with self._condition:
+            if self._warmed.pop(apod_date, None) is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if apod_date in self._queued_dates:
+                return
+            if len(self._queue) == self._queue.maxlen:
+                stale_date, _ = self._queue.pop()  # <- the oldest, the visitor has most likely moved on
+                self._queued_dates.discard(stale_date)
+                self.dropped += 1
+            self._queue.appendleft((apod_date, time.time()))
+            self._queued_dates.add(apod_date)
+            self.queued += 1
+            self._condition.notify()
+
+    def _next(self):
+        ''' Wait for the newest date that is not stale yet. Returns None once stopped '''
+        with self._condition:
+            while not self._stop.is_set():
+                while self._queue:
+                    apod_date, queued_at = self._queue.popleft()
+                    self._queued_dates.discard(apod_date)
+                    if time.time() - queued_at <= self.max_age:
+                        return apod_date
+                    self.dropped += 1
+                self._condition.wait(1)
+        return None
+
+    def _run(self):
+        while True:
+            apod_date = self._next()
+            if apod_date is None:
+                return
+            try:
+                warmed = self.warm(apod_date, self.window)
+            except Exception as error:  # <- never let a bad response kill the thread
+                print(f'Could not prefetch the days around {apod_date}: {error}')
+                continue
+            with self._condition:
+                for warmed_date in warmed:
+                    self._warmed[warmed_date] = True
+                    self._warmed.move_to_end(warmed_date)
+                while len(self._warmed) > MAX_WARMED:
+                    self._warmed.popitem(last=False)
+                self.warmed_dates += len(warmed)
+
+    def hitRatio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def start(self):
+        ''' Start the background thread. It is a daemon thread so it never keeps the program alive '''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='date-prefetcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
@@ -0,0 +1,102 @@
+'''
+apod_profiler.py is an opt-in sampling profiler for slow gallery requests.
+
+While it is enabled a background thread wakes up every few milliseconds and records the
+call stack of every thread that is serving a request. When a request takes longer than the
+threshold its samples are written to a file in the folded stack format, one line per distinct
+stack with the number of times it was seen:
+
+    home (gallery.py);getRandomImages (nasa_api.py);getRecords (nasa_api.py) 42
+
+The files are read by flame graph tools such as flamegraph.pl or speedscope. Requests that are
+fast enough are thrown away. Start the gallery with --profile-slow SECONDS to enable it.
+'''
+
+# built in imports
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SlowRequestProfiler():
+    '''Samples the stacks of threads serving requests and keeps the samples of slow requests
+
+    use:
+        profiler = SlowRequestProfiler(0.5, 'profiles').start()
+        profiler.begin()
+        ... serve the request ...
+        path = profiler.end('/date', seconds)  # <- path of the flame graph data or None
+
+    parameters:
+        threshold: requests taking at least this many seconds are written out
+        directory: directory the folded stack files are written to
+        interval: seconds between samples
+        max_files: stop writing files once this many have been written
+    '''
+    def __init__(self, threshold, directory, interval=0.005, max_files=100):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.max_files = max_files
+        self.files_written = 0
+        self._samples = {}  # <- thread id: Counter of folded stacks, for threads serving a request
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def begin(self):
+        ''' Start sampling the current thread '''
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+
+    def end(self, route, seconds):
+        ''' Stop sampling the current thread. Returns the path of the written samples when the
+        request took at least threshold seconds, None otherwise '''
+        with self._lock:
+            samples = self._samples.pop(threading.get_ident(), None)
+            if not samples or seconds < self.threshold or self.files_written >= self.max_files:
+                return None
+            self.files_written += 1
+        name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                            f'{name}-{int(seconds * 1000)}ms.folded')
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'w') as folded:
+            for stack, count in samples.most_common():
+                folded.write(f'{stack} {count}\n')
+        return path
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = list(self._samples)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            stacks = {thread: self._fold(frames[thread]) for thread in threads if thread in frames}
+            with self._lock:
+                for thread, stack in stacks.items():
+                    samples = self._samples.get(thread)
+                    if samples is not None:  # <- the request may have finished in the meantime
+                        samples[stack] += 1
+
+    def _fold(self, frame):
+        ''' Return the stack of frame as one line, outermost call first '''
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
@@ -0,0 +1,109 @@
+'''
+apod_refresher.py keeps a warm copy of today's APOD record in memory.
+
+A background thread follows the date as it rolls over at midnight and fetches the new day's
+record. NASA publishes the new picture some time after midnight, so until it is available the
+thread keeps retrying and the most recent published record is served in the meantime
+(stale while revalidate). Readers never wait on the upstream once a record is warm.
+'''
+
+# built in imports
+import threading
+import time
+from datetime import date, timedelta
+
+from apod_budget import INTERACTIVE, BACKGROUND
+from apod_dates import currentDate
+
+
+class TodayRefresher():
+    '''Background refresher for today's APOD record
+
+    use:
+        refresher = TodayRefresher(fetchRecord)
+        refresher.start()
+        record = refresher.record()  # warm copy, None until the first fetch finished
+
+    parameters:
+        fetch: callable taking a YYYY-MM-DD date and a priority (see apod_budget.py) and returning
+               the record dict for that date, or None if the record is not published (yet) or
+               could not be fetched
+        retry_interval: seconds between attempts while today's record is not published
+        refresh_interval: seconds between refreshes once today's record is warm
+    '''
+    def __init__(self, fetch, retry_interval=60, refresh_interval=3600):
+        self.fetch = fetch
+        self.retry_interval = retry_interval
+        self.refresh_interval = refresh_interval
+        self.refreshes = 0
+        self._record = None
+        self._fetched_at = 0
+        self._refreshing = threading.Lock()  # <- only one refresh is in flight at a time
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self):
+        ''' Return the warm record. This is the most recent published record, which is
+        yesterday's until today's APOD has been published. Never blocks on the upstream '''
+        return self._record
+
+    def latestDate(self):
+        ''' Return the date of the warm record, or today if nothing is warm yet '''
+        record = self._record
+        return record['date'] if record is not None else currentDate()
+
+    def isCurrent(self):
+        ''' True if the warm record is today's and was fetched within the refresh interval '''
+        record = self._record
+        return (record is not None and record['date'] == currentDate()
+                and time.time() - self._fetched_at < self.refresh_interval)
+
+    def refresh(self, priority=INTERACTIVE):
+        '''
+        Fetch today's record and make it the warm copy. If today's record is not published
+        and nothing is warm yet (a cold start shortly after midnight) yesterday's record is used.
+        Returns the warm record. A caller arriving while another refresh is in flight does
+        not wait for it and gets the current (possibly stale) warm record.
+        A visitor waiting on the refresh passes INTERACTIVE, the background thread BACKGROUND
+        '''
+        cold = self._record is None
+        if not self._refreshing.acquire(blocking=cold):
+            return self._record
+        try:
+            if cold and self._record is not None:
+                return self._record  # <- a cold caller waited for a refresh that just finished
+            today = currentDate()
+            record = self.fetch(today, priority)
+            if record is None and self._record is None:
+                yesterday = (date.fromisoformat(today) - timedelta(days=1)).strftime('%Y-%m-%d')
+                record = self.fetch(yesterday, priority)
+            if record is not None:
+                self._record = record
+                self._fetched_at = time.time()
+            self.refreshes += 1
+            return self._record
+        finally:
+            self._refreshing.release()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.isCurrent():
+                try:
+                    self.refresh(BACKGROUND)
+                except Exception as error:  # <- never let a bad response kill the thread
+                    print(f'Could not refresh todays image: {error}')
+            wait = self.refresh_interval if self.isCurrent() else self.retry_interval
+            # wake up at midnight at the latest so the new day is picked up straight away
+            tomorrow = date.today() + timedelta(days=1)
+            until_midnight = time.mktime(tomorrow.timetuple()) - time.time()
+            self._stop.wait(max(1, min(wait, until_midnight + 1)))
+
+    def start(self):
+        ''' Start the background thread. It is a daemon thread so it never keeps the program alive '''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='today-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,69 @@
+'''
+apod_sampler.py picks random APOD dates from the records already stored in the local
+record cache (see apod_cache.py) instead of asking the APOD api for count=N random images.
+
+The dates of all records that can be shown in the gallery are held in a compact array of
+day ordinals (4 bytes per date, roughly 40KB for the whole archive). Picking N dates without
+replacement from the array takes microseconds, compared to hundreds of milliseconds
+for a count=N request to NASA.
+'''
+
+# built in imports
+import random
+import threading
+import time
+from array import array
+from datetime import date
+
+# the index must hold at least this many dates before it is used. Sampling 15 images out
+# of a handful of cached dates would show the same images over and over again.
+MIN_INDEX_SIZE = 100
+
+
+class RandomSampler():
+    '''Random selection of APOD dates from the local record cache
+
+    use:
+        sampler = RandomSampler(apod_cache)
+        dates = sampler.sample(15)  # None if the index is too small to sample from
+
+    parameters:
+        cache: APODCache to build the index from
+        refresh_interval: seconds before the index is rebuilt to pick up newly cached records
+        min_size: minimum number of dates in the index before sample returns dates
+    '''
+    def __init__(self, cache, refresh_interval=600, min_size=MIN_INDEX_SIZE):
+        self.cache = cache
+        self.refresh_interval = refresh_interval
+        self.min_size = min_size
+        self.ordinals = array('i')
+        self.refreshed = 0  # <- time of the last index build, 0 forces a build on first use
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        ''' Rebuild the index of valid image dates from the cache '''
+        ordinals = array('i', (date.fromisoformat(apod_date).toordinal()
+                               for apod_date in self.cache.imageDates()))
+        with self._lock:
+            self.ordinals = ordinals
+            self.refreshed = time.time()
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def sample(self, count, partial=False):
+        '''
+        Return count distinct random dates as YYYY-MM-DD strings.
+        Returns None when the index holds fewer than min_size or count dates, unless partial
+        is True: then as many dates as the index holds are returned, None only if it is empty
+        '''
+        if time.time() - self.refreshed > self.refresh_interval:
+            self.refresh()
+        ordinals = self.ordinals  # <- a rebuild replaces the array, it never changes in place
+        if partial and len(ordinals) > 0:
+            count = min(count, len(ordinals))
+        elif len(ordinals) < max(count, self.min_size):
+            return None
+        # sampling a range only draws count indexes, the array itself is never copied
+        return [date.fromordinal(ordinals[index]).strftime('%Y-%m-%d')
+                for index in random.sample(range(len(ordinals)), count)]
@@ -0,0 +1,109 @@
+'''
+apod_search.py provides full text search over the title, explanation and copyright of
+every APOD record stored in the local record cache (see apod_cache.py).
+
+The index is a SQLite FTS5 table kept in the same database file as the records. Every row
+of the index is keyed on the day ordinal of its date, so replacing the row of a record is a
+rowid lookup instead of a scan of the whole index. The index is built when the gallery starts
+(and after apod_ingest.py) and then kept up to date incrementally: every search first indexes
+the records stored since the last update, which is a single indexed query when nothing new has
+arrived. Records are indexed in batches of UPDATE_BATCH, each in its own transaction, so
+threads and processes storing records are never locked out for long. A batch is read and
+written under one write lock, so workers starting together never index the same batch twice.
+Results are ranked with BM25, matches in the title count more than matches in the explanation.
+'''
+
+# built in imports
+import json
+import re
+import threading
+from datetime import date
+
+# relative weight of a match in the title, explanation and copyright columns
+BM25_WEIGHTS = (10.0, 1.0, 2.0)
+
+# number of records indexed in one transaction
+UPDATE_BATCH = 500
+
+
+def matchQuery(text):
+    '''
+    Turn free text typed by a user into an FTS5 query. Every word must match, the last word
+    also matches as a prefix so results show up while a word is still being typed.
+    Returns None if the text has no words
+    '''
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+    # quoting every word keeps FTS5 operators and punctuation typed by the user from being parsed
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SearchIndex():
+    '''Full text search index over the records in an APODCache
+
+    use:
+        index = SearchIndex(apod_cache)
+        records = index.search('crab nebula', limit=20)
+
+    parameters:
+        cache: APODCache whose records are indexed, the index lives in the same database
+    '''
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        db = cache.connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')  # <- workers starting together create the state row once
+            # rowid of an index row is the day ordinal of its date, see update
+            db.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS search_index
+                          USING fts5(date UNINDEXED, title, explanation, copyright,
+                                     tokenize='porter unicode61')''')
+            # rowid of the last record indexed. A replaced record gets a new, higher rowid
+            db.execute('CREATE TABLE IF NOT EXISTS search_index_state (last_rowid INTEGER NOT NULL)')
+            if db.execute('SELECT COUNT(*) FROM search_index_state').fetchone()[0] == 0:
+                db.execute('INSERT INTO search_index_state VALUES (0)')
+
+    def update(self):
+        ''' Index the records stored since the last update. Returns the number of records indexed '''
+        db = self.cache.connect()
+        indexed = 0
+        with self._lock:
+            while True:
+                with db:  # <- one transaction per batch
+                    # the write lock is taken before last_rowid is read, so when several workers
+                    # start together only one of them indexes a batch, the others wait and move on
+                    db.execute('BEGIN IMMEDIATE')
+                    last_rowid = db.execute('SELECT last_rowid FROM search_index_state').fetchone()[0]
+                    rows = db.execute('''SELECT rowid, date, record FROM records
+                                         WHERE rowid > ? ORDER BY rowid LIMIT ?''',
+                                      (last_rowid, UPDATE_BATCH)).fetchall()
+                    if not rows:
+                        return indexed
+                    for rowid, apod_date, record in rows:
+                        record = json.loads(record)
+                        ordinal = date.fromisoformat(apod_date).toordinal()
+                        db.execute('DELETE FROM search_index WHERE rowid = ?', (ordinal,))
+                        # media_type other can not be shown in the gallery, so it is never a result
+                        if record.get('media_type') in ('image', 'video'):
+                            db.execute('INSERT INTO search_index (rowid, date, title, explanation, copyright) '
+                                       'VALUES (?, ?, ?, ?, ?)',
+                                       (ordinal, apod_date, record.get('title', ''),
+                                        record.get('explanation', ''), record.get('copyright', '')))
+                    db.execute('UPDATE search_index_state SET last_rowid = ?', (rows[-1][0],))
+                indexed += len(rows)
+
+    def search(self, text, limit=20):
+        ''' Return up to limit records matching text, best match first '''
+        query = matchQuery(text)
+        if query is None:
+            return []
+        self.update()
+        rows = self.cache.connect().execute(f'''SELECT records.record FROM search_index
+                                                JOIN records ON records.date = search_index.date
+                                                WHERE search_index MATCH ?
+                                                ORDER BY bm25(search_index, 0, {', '.join(map(str, BM25_WEIGHTS))})
+                                                LIMIT ?''', (query, limit))
+        return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,108 @@
+'''
+apod_server.py runs the gallery under several worker processes for production use.
+
+The Flask development server started by app.run() is a single process. Here the parent
+process opens the listening socket and forks a number of workers that all accept connections
+from that socket, each one serving requests with a pool of threads. A worker that dies is
+replaced. Workers create their own Flask app after the fork, so no threads or database
+connections are shared between processes.
+
+Workers share the SQLite record cache on disk (see apod_cache.py). A record fetched by
+one worker is read by every other worker without another call to the APOD api. The api rate
+limit budget is kept in the same database, so the workers together stay within the limit and
+its reserve for visitors (see apod_budget.py).
+
+Forking needs a unix like system. On Windows a single threaded server is started instead.
+'''
+
+# built in imports
+import os
+import signal
+import socket
+import sys
+import time
+
+# Non built in imports
+from werkzeug.serving import make_server
+
+
+def runWorker(create_app, host, port, fd):
+    ''' Create the app and serve requests from the shared socket until told to stop '''
+    app = create_app()
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    # the parent sends SIGTERM to stop its workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def serve(create_app, host='127.0.0.1', port=5000, workers=None):
+    '''
+    Serve the app returned by create_app with workers processes (defaults to one per core).
+    Blocks until interrupted with Ctrl+C or SIGTERM.
+
+    parameters:
+        create_app: callable without arguments returning the Flask app, called in every worker
+        host, port: address to listen on
+        workers: number of worker processes
+    '''
+    workers = workers or os.cpu_count() or 1
+    if not hasattr(os, 'fork'):
+        print('Worker processes need os.fork, serving with threads in a single process instead')
+        make_server(host, port, create_app(), threaded=True).serve_forever()
+        return
+
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+
+    children = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                runWorker(create_app, host, port, listener.fileno())
+            except (SystemExit, KeyboardInterrupt):
+                pass
+            except BaseException as error:
+                print(f'worker {os.getpid()} failed: {error}')
+                status = 1
+            os._exit(status)
+        children.add(pid)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'Serving on http://{host}:{port} with {workers} worker processes')
+    for _ in range(workers):
+        spawn()
+
+    try:
+        while True:
+            pid, status = os.wait()
+            if pid in children:
+                children.discard(pid)
+                print(f'worker {pid} exited with status {status}, starting a new one')
+                time.sleep(1)  # <- do not spin if workers fail straight away
+                spawn()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        listener.close()
@@ -0,0 +1,126 @@
+'''
+bench_parse.py measures memory use and parse time of NASAImage objects for an archive
+sized list of records (see apod_image.py).
+
+It compares the slotted NASAImage and parseImages against the original __dict__ based
+class built with a list comprehension, and the json module against orjson (if installed).
+
+use:
+    python benchmarks/bench_parse.py
+    python benchmarks/bench_parse.py --records 20000 --repeat 5
+'''
+
+# built in imports
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apod_image import ERROR_IMAGE, parseImages, orjson
+from apod_dates import currentDate
+
+# a handful of photographers show up on many images, as they do in the real archive
+COPYRIGHTS = ['Robert Gendler', 'Tunc Tezel', 'Juan Carlos Casado', 'Damian Peach', 'Adam Block']
+
+
+class DictNASAImage():
+    ''' The NASAImage class as it was before __slots__, kept here as the baseline '''
+    def __init__(self, json_data):
+        if 'media_type' not in json_data.keys() or json_data['media_type'] == 'other':
+            json_data = dict(ERROR_IMAGE, date=currentDate())  # <- dated the day it is shown, as NASAImage does
+        try:
+            self.copyright = json_data['copyright']
+        except KeyError:
+            self.copyright = "Not Available"
+        self.title = json_data['title']
+        self.date = json_data['date']
+        if json_data['media_type'] == 'image':
+            self.url = json_data['url']
+        else:
+            self.url = json_data['thumbnail_url']
+        try:
+            self.hdurl = json_data['hdurl']
+        except KeyError:
+            self.hdurl = self.url
+        self.explanation = json_data['explanation']
+
+
+def makeRecords(count):
+    ''' Return count realistic looking APOD records, with videos, missing copyrights and hdurls '''
+    first = date(1995, 6, 16)
+    records = []
+    for day in range(count):
+        apod_date = (first + timedelta(days=day)).strftime('%Y-%m-%d')
+        record = {'date': apod_date,
+                  'title': f'Picture of the day {apod_date}',
+                  'explanation': f'An explanation of the picture of {apod_date}. ' * 20,
+                  'media_type': 'video' if day % 17 == 0 else 'image',
+                  'service_version': 'v1',
+                  'url': f'https://apod.nasa.gov/apod/image/{day}/picture.jpg'}
+        if day % 17 == 0:
+            record['thumbnail_url'] = f'https://img.youtube.com/vi/{day}/0.jpg'
+        if day % 3:
+            record['hdurl'] = f'https://apod.nasa.gov/apod/image/{day}/picture_big.jpg'
+        if day % 2:
+            record['copyright'] = COPYRIGHTS[day % len(COPYRIGHTS)]
+        records.append(record)
+    return records
+
+
+def timeIt(function, repeat):
+    ''' Return the best time in milliseconds of repeat calls to function '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def memoryOf(function):
+    ''' Return the bytes still allocated by the result of function '''
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark NASAImage memory use and parse time')
+    parser.add_argument('--records', type=int, default=10000, help='number of records to parse')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs, the best is reported')
+    args = parser.parse_args(argv)
+
+    raw = json.dumps(makeRecords(args.records)).encode('utf-8')
+    decoded = json.loads(raw)
+
+    print(f'{args.records} records, {len(raw) / 1024 / 1024:.1f} MB of JSON')
+    print(f'{"":36}{"time ms":>10}{"objects MB":>12}')
+    rows = [('dict class, list comprehension', lambda: [DictNASAImage(item) for item in decoded],
+             lambda: [DictNASAImage(item) for item in json.loads(raw)]),
+            ('slotted NASAImage, parseImages', lambda: parseImages(decoded),
+             lambda: parseImages(json.loads(raw)))]
+    for name, build, _ in rows:
+        # memory is measured from the decoded records so only the image objects are counted
+        print(f'{name:36}{timeIt(build, args.repeat):>10.1f}{memoryOf(build) / 1024 / 1024:>12.2f}')
+
+    print()
+    print(f'{"decode and build from raw bytes":36}{"time ms":>10}')
+    for name, _, from_raw in rows:
+        print(f'{name + " (json)":36}{timeIt(from_raw, args.repeat):>10.1f}')
+    if orjson is not None:
+        print(f'{"parseImages(raw bytes) (orjson)":36}{timeIt(lambda: parseImages(raw), args.repeat):>10.1f}')
+    else:
+        print('orjson is not installed, parseImages(raw bytes) uses the json module')
+
+
+if __name__ == '__main__':
+    main()
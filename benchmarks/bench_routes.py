@@ -0,0 +1,187 @@
+'''
+bench_routes.py benchmarks the gallery routes against the local stub APOD api (stub_apod.py),
+so nothing is sent to api.nasa.gov and the numbers do not depend on NASA's servers.
+
+For each route the Flask app is driven by a number of concurrent threads, and the suite
+reports requests per second, p50/p95/p99 latency, error pages and the number of upstream
+calls the route made. Micro benchmarks time getImages and rendering the gallery template.
+
+The results are written as JSON to benchmarks/results/ (one file per run, keys sorted) so
+runs can be diffed over time, or compared directly with --compare.
+
+use:
+    python benchmarks/bench_routes.py
+    python benchmarks/bench_routes.py --requests 500 --concurrency 16 --latency 0.2 --error-rate 0.05
+    python benchmarks/bench_routes.py --compare benchmarks/results/routes-20240101-120000.json
+'''
+
+# built in imports
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_apod import StubAPOD, FIRST_APOD_DATE
+
+# route name: function returning the path to request
+ROUTES = {'/': lambda pick: '/',
+          '/today': lambda pick: '/today',
+          '/date': lambda pick: f'/date?date={pick.isoformat()}',
+          '/random': lambda pick: '/random?random_count=10'}
+
+
+def percentile(values, fraction):
+    ''' Nearest rank percentile of a sorted list '''
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1)]
+
+
+def benchRoute(app, stub, route, requests, concurrency, seed):
+    ''' Request route requests times from concurrency threads and return the measurements '''
+    picker = random.Random(seed)
+    span = (date.today() - FIRST_APOD_DATE).days
+    paths = [ROUTES[route](FIRST_APOD_DATE + timedelta(days=picker.randrange(span))) for _ in range(requests)]
+    local = threading.local()
+
+    def call(path):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        start = time.perf_counter()
+        response = client.get(path)
+        body = response.get_data()
+        return time.perf_counter() - start, response.status_code, b'Error: Not Found' in body
+
+    calls_before = stub.calls
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, paths))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(result[0] * 1000 for result in results)
+    return {'requests': requests,
+            'concurrency': concurrency,
+            'rps': round(requests / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'errors': sum(1 for result in results if result[1] >= 500),
+            'error_pages': sum(1 for result in results if result[2]),
+            'upstream_calls': stub.calls - calls_before}
+
+
+def timeIt(function, repeat):
+    ''' Return the median time in milliseconds of repeat calls to function '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(sorted(times)[len(times) // 2], 3)
+
+
+def microBenchmarks(app, repeat):
+    ''' Time getImages against the stub and rendering the template with 1 and 15 images '''
+    import nasa_api
+    from flask import render_template
+
+    single_url = f'{nasa_api.baseUrl}?date=2021-03-13&thumbs=true'
+    count_url = f'{nasa_api.baseUrl}?count=15&thumbs=true'
+    one_image = nasa_api.getImages(single_url)
+    fifteen_images = nasa_api.getImages(count_url)
+    with app.test_request_context('/'):
+        return {'getImages_date_ms': timeIt(lambda: nasa_api.getImages(single_url), repeat),
+                'getImages_count15_ms': timeIt(lambda: nasa_api.getImages(count_url), repeat),
+                'render_1_image_ms': timeIt(lambda: render_template('nasa_gallery.html', images=one_image,
+                                                                    todays_date='2021-03-13'), repeat),
+                'render_15_images_ms': timeIt(lambda: render_template('nasa_gallery.html', images=fifteen_images,
+                                                                      todays_date='2021-03-13'), repeat)}
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printComparison(current, previous):
+    print(f'\ncompared with {previous.get("commit")} at {previous.get("timestamp")}')
+    for route, numbers in current['routes'].items():
+        before = previous.get('routes', {}).get(route)
+        if before is None:
+            continue
+        changes = ', '.join(f'{key} {before[key]} -> {numbers[key]}'
+                            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'upstream_calls'))
+        print(f'{route:10}{changes}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the gallery routes against a local stub APOD api')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--routes', nargs='+', default=list(ROUTES), choices=list(ROUTES))
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the stub adds to every response')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='fraction of slow stub responses')
+    parser.add_argument('--slow-latency', type=float, default=2.0, help='seconds a slow stub response takes')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 503 stub responses')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per micro benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the dates requested from /date')
+    parser.add_argument('--output', default=None, help='results file, defaults to benchmarks/results/routes-<time>.json')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare with')
+    args = parser.parse_args(argv)
+
+    stub = StubAPOD(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                    error_rate=args.error_rate).start()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        from gallery import create_app
+        app = create_app({'APOD_CACHE_PATH': os.path.join(temp_dir, 'apod_cache.sqlite3'),
+                          'IMAGE_CACHE_DIR': os.path.join(temp_dir, 'image_cache'),
+                          'APOD_API_URL': stub.url,
+                          'START_REFRESHER': False,
+                          # the prefetcher makes api calls and downloads images from apod.nasa.gov
+                          # nobody asked for, which would leave the machine and skew upstream_calls
+                          'PREFETCH_DAYS': 0})
+
+        results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'commit': gitCommit(),
+                   'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+                   'routes': {}}
+        print(f'{"route":10}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}{"err pages":>10}{"upstream":>10}')
+        for route in args.routes:
+            numbers = benchRoute(app, stub, route, args.requests, args.concurrency, args.seed)
+            results['routes'][route] = numbers
+            print(f'{route:10}{numbers["rps"]:>9}{numbers["p50_ms"]:>9}{numbers["p95_ms"]:>9}{numbers["p99_ms"]:>9}'
+                  f'{numbers["errors"]:>8}{numbers["error_pages"]:>10}{numbers["upstream_calls"]:>10}')
+
+        results['micro'] = microBenchmarks(app, args.repeat)
+        print()
+        for name, value in results['micro'].items():
+            print(f'{name:24}{value:>10} ms')
+    stub.stop()
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'routes-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    print(f'\nresults written to {output}')
+
+    if args.compare:
+        with open(args.compare) as previous:
+            printComparison(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
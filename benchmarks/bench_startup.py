@@ -0,0 +1,77 @@
+'''
+bench_startup.py measures how long a fresh python process takes to import the gallery
+and to create the Flask app with gallery.create_app.
+
+Importing nasa_api.py used to run pip list in a subprocess, rewrite the template and start
+the server, which took seconds. Both steps should now take a fraction of a second. Pass
+--max-ms to fail (exit code 1) when the median create_app time is over a limit, so a slow
+import sneaking back in is caught.
+
+use:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --max-ms 1000
+'''
+
+# built in imports
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# each step is timed inside the child process, so interpreter start up is not counted
+IMPORT_ONLY = '''
+import time
+start = time.perf_counter()
+import gallery
+print((time.perf_counter() - start) * 1000)
+'''
+
+CREATE_APP = '''
+import time
+start = time.perf_counter()
+import gallery
+gallery.create_app({{'APOD_CACHE_PATH': {cache!r}, 'IMAGE_CACHE_DIR': {images!r}, 'START_REFRESHER': False}})
+print((time.perf_counter() - start) * 1000)
+'''
+
+
+def timeChild(code, runs):
+    ''' Run code in runs fresh python processes and return the milliseconds each one printed '''
+    times = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                                capture_output=True, text=True, stdin=subprocess.DEVNULL).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark gallery import and app creation time')
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh processes per measurement')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='fail if the median create_app time is over this many milliseconds')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        create_app = CREATE_APP.format(cache=os.path.join(temp_dir, 'apod_cache.sqlite3'),
+                                       images=os.path.join(temp_dir, 'image_cache'))
+        results = {'import gallery': timeChild(IMPORT_ONLY, args.runs),
+                   'import + create_app': timeChild(create_app, args.runs)}
+
+    print(f'{"":24}{"median ms":>10}{"max ms":>10}')
+    for name, times in results.items():
+        print(f'{name:24}{statistics.median(times):>10.1f}{max(times):>10.1f}')
+
+    median = statistics.median(results['import + create_app'])
+    if args.max_ms is not None and median > args.max_ms:
+        print(f'create_app took {median:.1f} ms, over the limit of {args.max_ms} ms')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+'''
+load_test.py shows how the throughput of the production serving mode (nasa_api.py --workers)
+scales with the number of worker processes.
+
+A temporary record cache is filled with synthetic records first, the server is pointed at an
+api url nothing listens on, so every request is answered from the shared cache and no request
+leaves this machine. For each worker count the server is started, warmed up and hit by several
+client processes for a fixed time.
+
+use:
+    python benchmarks/load_test.py                       # 1, 2, 4 ... up to one worker per core
+    python benchmarks/load_test.py --workers 1 2 --duration 5 --path /date
+'''
+
+# built in imports
+import argparse
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from multiprocessing import Pool
+
+# Non built in imports
+import requests as reqs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from apod_cache import APODCache
+from bench_parse import makeRecords
+
+
+def freePort():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def seedCache(path, count):
+    ''' Fill the record cache at path with count records ending today, return their dates '''
+    records = makeRecords(count)
+    first = date.today() - timedelta(days=count - 1)
+    for day, record in enumerate(records):
+        record['date'] = (first + timedelta(days=day)).strftime('%Y-%m-%d')
+    APODCache(path).putMany(records)
+    return [record['date'] for record in records]
+
+
+def clientLoop(args):
+    ''' Run threads requesting random dates until the deadline, return (requests, errors, latencies) '''
+    base, path, dates, threads, deadline = args
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run():
+        session = reqs.Session()
+        mine = []
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                response = session.get(f'{base}{path}?date={random.choice(dates)}', timeout=10)
+                response.content
+                failed = response.status_code != 200
+            except reqs.RequestException:
+                failed = True
+            mine.append(time.perf_counter() - start)
+            if failed:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(latencies), errors[0], latencies
+
+
+def waitForServer(base, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            reqs.get(f'{base}/api/apod/search?q=warmup', timeout=1)
+            return
+        except reqs.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def measure(workers, cache, images, dates, args):
+    port = freePort()
+    base = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'nasa_api.py'), '--workers', str(workers),
+                               '--port', str(port), '--no-browser', '--cache', cache, '--image-cache', images,
+                               '--api-url', 'http://127.0.0.1:9/planetary/apod'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        waitForServer(base)
+        # warm up the in-process caches of every worker
+        clientLoop((base, args.path, dates, 4, time.time() + 1))
+        deadline = time.time() + args.duration
+        with Pool(args.clients) as pool:
+            results = pool.map(clientLoop, [(base, args.path, dates, args.threads, deadline)] * args.clients)
+    finally:
+        server.terminate()
+        server.wait()
+
+    count = sum(result[0] for result in results)
+    errors = sum(result[1] for result in results)
+    latencies = sorted(latency for result in results for latency in result[2])
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+    return count / args.duration, statistics.median(latencies) * 1000 if latencies else 0, p95, errors
+
+
+def main(argv=None):
+    cores = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, cores} & set(range(1, cores + 1))) or [1]
+    parser = argparse.ArgumentParser(description='Throughput of nasa_api.py --workers by worker count')
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers, help='worker counts to test')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per worker count')
+    parser.add_argument('--clients', type=int, default=max(2, cores), help='client processes generating load')
+    parser.add_argument('--threads', type=int, default=8, help='threads per client process')
+    parser.add_argument('--records', type=int, default=2000, help='records seeded into the cache')
+    parser.add_argument('--path', default='/api/apod', help='route to request with ?date=')
+    args = parser.parse_args(argv)
+
+    print(f'{cores} cores, {args.clients} client processes x {args.threads} threads, {args.path}')
+    print(f'{"workers":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"errors":>8}')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = os.path.join(temp_dir, 'apod_cache.sqlite3')
+        dates = seedCache(cache, args.records)
+        for workers in args.workers:
+            rps, p50, p95, errors = measure(workers, cache, os.path.join(temp_dir, 'image_cache'), dates, args)
+            print(f'{workers:>8}{rps:>10.0f}{p50:>10.1f}{p95:>10.1f}{errors:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+'''
+stub_apod.py is a local stand-in for the APOD api used by the benchmarks.
+
+It answers the same requests as https://api.nasa.gov/planetary/apod (date, start_date and
+end_date, count) with realistic records. Every date always gets the same record: most are
+images, some are videos with a thumbnail_url, a few are media_type other, and copyright and
+hdurl are missing on some. Latency, slow responses and errors can be injected, and every call
+is counted so a benchmark can report how many upstream calls a route made. Like api.nasa.gov
+every api_key has a rate limit, reported in X-RateLimit-Remaining and answered with a 429 once
+it is used up.
+
+use:
+    python benchmarks/stub_apod.py --port 8000 --latency 0.2 --error-rate 0.05
+    python nasa_api.py --api-url http://127.0.0.1:8000/planetary/apod
+
+    stub = StubAPOD(latency=0.1).start()
+    ... stub.url, stub.calls ...
+    stub.stop()
+'''
+
+# built in imports
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIRST_APOD_DATE = date(1995, 6, 16)
+
+# APOD skipped these days in its first week, the api has no record for them
+SKIPPED_DATES = {date(1995, 6, 17), date(1995, 6, 18), date(1995, 6, 19)}
+
+WORDS = ('nebula galaxy star cluster comet planet moon aurora eclipse supernova dust gas light '
+         'telescope spiral orbit sun jupiter saturn mars milky way hydrogen emission image sky').split()
+
+COPYRIGHTS = ('Robert Gendler', 'Tunc Tezel', 'Juan Carlos Casado', 'Damian Peach', 'Adam Block')
+
+
+def makeRecord(apod_date):
+    ''' Return the record for apod_date (a date). The same date always gets the same record '''
+    seed = int(hashlib.md5(apod_date.isoformat().encode('utf-8')).hexdigest(), 16)
+    words = random.Random(seed)
+    day = apod_date.strftime('%y%m%d')
+    record = {'date': apod_date.isoformat(),
+              'title': ' '.join(words.choice(WORDS) for _ in range(3)).title(),
+              'explanation': ' '.join(words.choice(WORDS) for _ in range(160)) + '.',
+              'service_version': 'v1'}
+    kind = seed % 100
+    if kind < 3:
+        # interactive pages and flash animations, these can not be shown in the gallery
+        record.update(media_type='other')
+    elif kind < 12:
+        record.update(media_type='video', url=f'https://www.youtube.com/embed/{day}?rel=0',
+                      thumbnail_url=f'https://img.youtube.com/vi/{day}/0.jpg')
+    else:
+        record.update(media_type='image', url=f'https://apod.nasa.gov/apod/image/{day[:4]}/{day}.jpg')
+        if seed % 7:
+            record['hdurl'] = f'https://apod.nasa.gov/apod/image/{day[:4]}/{day}_big.jpg'
+    if seed % 3 == 0:
+        record['copyright'] = COPYRIGHTS[seed % len(COPYRIGHTS)]
+    return record
+
+
+class StubAPOD():
+    '''Local APOD api stub server running in a background thread
+
+    parameters:
+        port: port to listen on, 0 picks a free port
+        latency: seconds added to every response
+        slow_rate: fraction of responses delayed by slow_latency instead
+        slow_latency: seconds a slow response takes
+        error_rate: fraction of responses answered with a 503
+        rate_limit: calls allowed per api_key
+    '''
+    def __init__(self, port=0, latency=0.0, slow_rate=0.0, slow_latency=2.0, error_rate=0.0, rate_limit=1000):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.calls_by_kind = {'date': 0, 'range': 0, 'count': 0, 'error': 0, 'over_limit': 0}
+        self.rate_limit = rate_limit
+        self.remaining = {}  # <- api_key: calls left
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/planetary/apod'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are separate writes on a keep-alive connection. With Nagle's algorithm
+            # the body waits for the delayed ACK of the headers, adding about 40 ms to every response
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, body, remaining = stub.answer(urlparse(self.path).query)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('X-RateLimit-Limit', str(stub.rate_limit))
+                self.send_header('X-RateLimit-Remaining', str(remaining))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def answer(self, query):
+        ''' Return (status, JSON body, calls left for the api_key) for a query string '''
+        params = {key: values[0] for key, values in parse_qs(query).items()}
+        api_key = params.get('api_key', 'DEMO_KEY')
+        status, body = self._answer(params, api_key)
+        return status, body, max(self.remaining[api_key], 0)
+
+    def _answer(self, params, api_key):
+        kind = 'count' if 'count' in params else 'range' if 'start_date' in params else 'date'
+        with self._lock:
+            self.calls += 1
+            self.calls_by_kind[kind] += 1
+            remaining = self.remaining[api_key] = self.remaining.get(api_key, self.rate_limit) - 1
+            roll = self._random.random()
+        if remaining < 0:
+            with self._lock:
+                self.calls_by_kind['over_limit'] += 1
+            return 429, {'error': {'code': 'OVER_RATE_LIMIT', 'message': 'You have exceeded your rate limit.'}}
+        time.sleep(self.slow_latency if roll < self.slow_rate else self.latency)
+        if roll > 1 - self.error_rate:
+            with self._lock:
+                self.calls_by_kind['error'] += 1
+            return 503, {'error': {'code': 'SERVICE_UNAVAILABLE', 'message': 'injected error'}}
+
+        today = date.today()
+        if kind == 'count':
+            span = (today - FIRST_APOD_DATE).days
+            days = random.sample(range(span + 1), min(int(params['count']), 100))
+            return 200, [makeRecord(FIRST_APOD_DATE + timedelta(days=day)) for day in days]
+        try:
+            if kind == 'range':
+                start = datetime.strptime(params['start_date'], '%Y-%m-%d').date()
+                end = datetime.strptime(params.get('end_date', today.isoformat()), '%Y-%m-%d').date()
+            else:
+                start = end = datetime.strptime(params.get('date', today.isoformat()), '%Y-%m-%d').date()
+        except ValueError:
+            return 400, {'code': 400, 'msg': 'time data does not match format %Y-%m-%d', 'service_version': 'v1'}
+        if start < FIRST_APOD_DATE or end > today or start > end:
+            return 400, {'code': 400, 'msg': f'Date must be between Jun 16, 1995 and {today:%b %d, %Y}.',
+                         'service_version': 'v1'}
+        days = [start + timedelta(days=day) for day in range((end - start).days + 1)]
+        records = [makeRecord(day) for day in days if day not in SKIPPED_DATES]
+        if kind == 'range':
+            return 200, records
+        if not records:
+            return 404, {'code': 404, 'msg': f'No data available for date: {start}', 'service_version': 'v1'}
+        return 200, records[0]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='stub-apod', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stub of the APOD api')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='fraction of slow responses')
+    parser.add_argument('--slow-latency', type=float, default=2.0, help='seconds a slow response takes')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 503 responses')
+    parser.add_argument('--rate-limit', type=int, default=1000, help='calls allowed per api_key')
+    args = parser.parse_args(argv)
+
+    stub = StubAPOD(args.port, args.latency, args.slow_rate, args.slow_latency, args.error_rate, args.rate_limit)
+    print(f'Stub APOD api on {stub.url}')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
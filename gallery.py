@@ -0,0 +1,427 @@
+'''
+gallery.py is the web server and image gallery for the NASA astronomy picture of the day,
+built using python, flask, jinja, html, css, and bootstrap. The images are queried with the
+functions in nasa_api.py and displayed with templates/nasa_gallery.html.
+
+create_app() is an app factory, importing this module does not open any files or start
+anything. Start the gallery with python nasa_api.py, or point a WSGI server at the factory:
+
+    flask --app gallery:create_app run
+
+The page cache, image proxy, prefetcher and profiler belong to the app they were created for
+(see GalleryState), the record cache and api client of nasa_api.py are shared by every app.
+
+Request and stage timings, upstream health and cache hit ratios are served on /metrics in the
+Prometheus text format (see apod_metrics.py). Every response also carries a Server-Timing header
+with the time spent per stage, which shows up in the network tab of the browser dev tools.
+'''
+
+# built in imports
+import json
+import os
+import time
+from datetime import timedelta
+from functools import partial
+
+# Non built in imports
+from flask import Blueprint, Flask, Response, current_app, render_template, request, abort, redirect, send_file, url_for
+from flask import g, jsonify, stream_with_context
+import nasa_api
+from nasa_api import (NASAImage, ERROR_IMAGE, FIRST_APOD_DATE, getTodaysImage, getRandomImages,
+                      getImageByDate, searchImages, getRangeRecords, IncompleteRange, parseDate,
+                      normalizeDate)
+from page_cache import PageCache
+from image_proxy import ImageProxy, SIZES, CACHE_MAX_AGE, isAllowed, mimetype
+from apod_metrics import metrics
+from apod_profiler import SlowRequestProfiler
+from apod_budget import INTERACTIVE, BACKGROUND
+from apod_prefetch import Prefetcher
+
+# maximum number of days returned by one page of /api/apod/range
+MAX_RANGE_PAGE_DAYS = 1000
+
+# number of carousel slides loading their image with the page, the others load as they come up
+EAGER_SLIDES = 3
+
+# number of slides sent to a random slideshow each time it gets close to its last slide
+MORE_SLIDES = 5
+
+# Every route of the gallery is registered on this blueprint by create_app
+gallery = Blueprint('gallery', __name__)
+
+
+class GalleryState():
+    '''The objects of one gallery app, kept on app.extensions['gallery'] by create_app
+
+    use:
+        state = currentState()  # <- the state of the app handling the current request
+        page = state.page_cache.get(key)
+
+    parameters:
+        page_cache: PageCache of the rendered pages
+        image_proxy: ImageProxy resizing and serving the images
+        prefetcher: Prefetcher warming the days around looked up dates, None when disabled
+        profiler: SlowRequestProfiler, None when disabled
+    '''
+    def __init__(self, page_cache, image_proxy, prefetcher=None, profiler=None):
+        self.page_cache = page_cache
+        self.image_proxy = image_proxy
+        self.prefetcher = prefetcher
+        self.profiler = profiler
+
+
+def currentState():
+    return current_app.extensions['gallery']
+
+
+def create_app(config=None):
+    '''
+    Create the Flask instance for the gallery.
+
+    parameters:
+        config: dict of settings overriding the defaults below
+            APOD_CACHE_PATH: location of the SQLite record cache
+            IMAGE_CACHE_DIR: directory the resized images are stored in
+            APOD_API_URL: APOD api url, for example a local stub server
+            START_REFRESHER: start the background thread keeping todays image warm
+            PREFETCH_DAYS: days on either side of a looked up date to warm in the background, 0 disables it
+            PROFILE_SLOW_REQUESTS: seconds, requests taking longer are profiled. None disables the profiler
+            PROFILE_DIR: directory the flame graph data of slow requests is written to
+    '''
+    app = Flask(__name__)  # <- templates are found next to this file, whatever the working directory
+    app.config['DEBUG'] = False  # Set true for live updates when editing code
+    app.config['APOD_CACHE_PATH'] = os.path.join(nasa_api.HERE, 'apod_cache.sqlite3')
+    app.config['IMAGE_CACHE_DIR'] = os.path.join(nasa_api.HERE, 'image_cache')
+    app.config['APOD_API_URL'] = nasa_api.baseUrl
+    app.config['START_REFRESHER'] = True
+    app.config['PREFETCH_DAYS'] = 3
+    app.config['PROFILE_SLOW_REQUESTS'] = None
+    app.config['PROFILE_DIR'] = os.path.join(nasa_api.HERE, 'profiles')
+    app.config.update(config or {})
+
+    # the record cache and api client are shared, raises ValueError when an earlier app used other ones
+    nasa_api.init(app.config['APOD_CACHE_PATH'], app.config['APOD_API_URL'])
+    # Pages for today and for a specific date are always the same until the date rolls over,
+    # so they are rendered once and kept compressed in memory. See page_cache.py for details.
+    page_cache = PageCache()
+    # Images are downloaded once, resized for the carousel and served from local disk
+    # instead of pulling the full size image from NASA on every view. See image_proxy.py
+    image_proxy = ImageProxy(app.config['IMAGE_CACHE_DIR'])
+    prefetcher = profiler = None
+    if app.config['PREFETCH_DAYS'] > 0:
+        # visitors step through the archive a day at a time, warm the days around every
+        # date they look at. See apod_prefetch.py for details.
+        prefetcher = Prefetcher(partial(warmDays, image_proxy=image_proxy),
+                                window=app.config['PREFETCH_DAYS']).start()
+    if app.config['PROFILE_SLOW_REQUESTS'] is not None:
+        # sample the stacks of requests and keep flame graph data of the slow ones. See apod_profiler.py
+        profiler = SlowRequestProfiler(app.config['PROFILE_SLOW_REQUESTS'], app.config['PROFILE_DIR']).start()
+    app.extensions['gallery'] = GalleryState(page_cache, image_proxy, prefetcher, profiler)
+    collectMetrics()
+
+    app.register_blueprint(gallery)
+    if app.config['START_REFRESHER']:
+        # start keeping todays image warm in the background
+        nasa_api.today_refresher.start()
+    return app
+
+
+def latestDate():
+    ''' The date of the newest published APOD, the max date of the date picker '''
+    return nasa_api.today_refresher.latestDate()
+
+
+def isErrorPage(images):
+    ''' Pages showing the error image may be a temporary failure, they are never cached '''
+    return any(image.title == ERROR_IMAGE['title'] for image in images)
+
+
+def warmDays(apod_date, days, image_proxy):
+    '''
+    Store the records of the days on either side of apod_date in the record cache, with one
+    api call for all of them, and resize their images with image_proxy. Used by the prefetcher,
+    so the api is only called while there is budget to spare. Returns the dates that were
+    fetched or resized, dates that were already warm are left out so they do not count as hits
+    '''
+    center = parseDate(apod_date)
+    start = max(center - timedelta(days=days), parseDate(FIRST_APOD_DATE))
+    end = min(center + timedelta(days=days), parseDate(latestDate()))
+    cached = nasa_api.apod_cache.getRange(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+    records = {}
+    try:
+        for record in getRangeRecords(start, end, priority=BACKGROUND):
+            records[record['date']] = record
+    except IncompleteRange:
+        pass  # <- the budget or the api refused the call, warm the days that did arrive
+    records.pop(apod_date, None)  # <- the visitor already has this one
+    warmed = {warm_date for warm_date in records if warm_date not in cached}
+    # nearest days first, the next or previous day is the most likely next step
+    for warm_date in sorted(records, key=lambda warm_date: abs(parseDate(warm_date) - center)):
+        src = NASAImage(records[warm_date]).url
+        if isAllowed(src) and not os.path.exists(image_proxy.path(src, 'carousel')):
+            try:
+                # one image at a time, so images a visitor is waiting for are not queued behind these
+                image_proxy.submit(src, 'carousel').result(timeout=60)
+                warmed.add(warm_date)
+            except Exception:
+                pass  # <- the image is resized when it is shown instead
+    return sorted(warmed)
+
+
+def renderGallery(images, template='nasa_gallery.html', **context):
+    ''' Render the gallery template (or a part of it), timed as the render stage '''
+    with metrics.span('render'):
+        return render_template(template, images=images, **context)
+
+
+@gallery.app_context_processor
+def slideSettings():
+    ''' Available in every template, see templates/slides.html '''
+    return {'eager_slides': EAGER_SLIDES}
+
+
+def ratio(hits, misses):
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def prefetcherValue(read):
+    ''' read(prefetcher) of the current app, None when it has no prefetcher '''
+    prefetcher = currentState().prefetcher
+    return read(prefetcher) if prefetcher is not None else None
+
+
+def collectMetrics():
+    '''
+    Values kept by the caches, the api client and the image proxy, read when /metrics is scraped.
+    The page cache, prefetcher and image proxy are read from the app serving /metrics
+    '''
+    metrics.collect('apod_record_cache_hits_total', 'Record lookups answered by the local cache', 'counter',
+                    lambda: nasa_api.apod_cache.hits)
+    metrics.collect('apod_record_cache_misses_total', 'Record lookups missing from the local cache', 'counter',
+                    lambda: nasa_api.apod_cache.misses)
+    metrics.collect('apod_record_cache_hit_ratio', 'Share of record lookups answered by the local cache', 'gauge',
+                    lambda: ratio(nasa_api.apod_cache.hits, nasa_api.apod_cache.misses))
+    metrics.collect('apod_page_cache_hits_total', 'Pages answered from the rendered page cache', 'counter',
+                    lambda: currentState().page_cache.hits)
+    metrics.collect('apod_page_cache_misses_total', 'Pages rendered because they were not cached', 'counter',
+                    lambda: currentState().page_cache.misses)
+    metrics.collect('apod_page_cache_hit_ratio', 'Share of cacheable pages answered from the page cache', 'gauge',
+                    lambda: ratio(currentState().page_cache.hits, currentState().page_cache.misses))
+    metrics.collect('apod_upstream_calls_total', 'Calls made to the APOD api', 'counter',
+                    lambda: nasa_api.apod_client.upstream_calls)
+    metrics.collect('apod_upstream_coalesced_calls_total', 'Calls that shared the result of an identical call',
+                    'counter', lambda: nasa_api.apod_client.coalesced_calls)
+    metrics.collect('apod_upstream_budget_remaining', 'Estimated api calls left over all api keys', 'gauge',
+                    lambda: nasa_api.api_budget.remaining())
+    metrics.collect('apod_upstream_budget_refused_interactive_total', 'Visitor api calls refused by the budget',
+                    'counter', lambda: nasa_api.api_budget.refused[INTERACTIVE])
+    metrics.collect('apod_upstream_budget_refused_background_total', 'Background api calls refused by the budget',
+                    'counter', lambda: nasa_api.api_budget.refused[BACKGROUND])
+    metrics.collect('apod_prefetch_hits_total', 'Date lookups of a date warmed by the prefetcher', 'counter',
+                    lambda: prefetcherValue(lambda prefetcher: prefetcher.hits))
+    metrics.collect('apod_prefetch_misses_total', 'Date lookups of a date the prefetcher had not warmed', 'counter',
+                    lambda: prefetcherValue(lambda prefetcher: prefetcher.misses))
+    metrics.collect('apod_prefetch_hit_ratio', 'Share of date lookups warmed by the prefetcher', 'gauge',
+                    lambda: prefetcherValue(lambda prefetcher: prefetcher.hitRatio()))
+    metrics.collect('apod_prefetch_dropped_total', 'Queued dates dropped because the visitor moved on', 'counter',
+                    lambda: prefetcherValue(lambda prefetcher: prefetcher.dropped))
+    metrics.collect('apod_prefetch_warmed_dates_total', 'Dates warmed by the prefetcher', 'counter',
+                    lambda: prefetcherValue(lambda prefetcher: prefetcher.warmed_dates))
+    metrics.collect('apod_images_generated_total', 'Resized images generated by the image proxy', 'counter',
+                    lambda: currentState().image_proxy.generated)
+
+
+# ----------------------------- default end point ---------------------------- #
+
+@gallery.route('/', methods=['GET'])
+def home():
+    images = getRandomImages(15)
+    return renderGallery(images, todays_date=latestDate(), more_url=url_for('gallery.slides'))
+
+# ------------------------ local image proxy end point ----------------------- #
+
+@gallery.app_template_global()
+def imageUrl(src, size):
+    ''' Used in the template to reference the derivative of an image instead of the original '''
+    if not isAllowed(src):
+        return src
+    return url_for('gallery.image', size=size, src=src)
+
+@gallery.route('/image/<size>', methods=['GET'])
+def image(size):
+    src = request.args.get('src', type=str)
+    if size not in SIZES or not isAllowed(src):
+        abort(404)
+    try:
+        path = currentState().image_proxy.derivative(src, size)
+    except Exception:
+        # the image could not be downloaded or resized, let the browser try the original
+        return redirect(src)
+    # send_file answers Range, If-None-Match and If-Modified-Since requests
+    return send_file(path, mimetype=mimetype(src), conditional=True,
+                     max_age=CACHE_MAX_AGE)
+
+# -------------------------- APOD for today endpoint ------------------------- #
+
+@gallery.route('/today', methods=['GET'])
+def today():
+    page_cache = currentState().page_cache
+    latest_date = latestDate()
+    key = ('today', latest_date)
+    page = page_cache.get(key)
+    if page is None:
+        images = getTodaysImage()
+        html = renderGallery(images, todays_date=latest_date)
+        if isErrorPage(images):
+            return html
+        # todays record may still be corrected after it is published, keep the page for a minute
+        page = page_cache.put(key, html, ttl=60)
+    return page.response()
+
+# --------------------------- APOD by date endpoint -------------------------- #
+
+@gallery.route('/date', methods=['GET'])
+def date():
+    date = normalizeDate(request.args.get('date', type=str))  # <- one cache entry for 2020-1-5 and 2020-01-05
+    latest_date = latestDate()
+    page_cache, prefetcher = currentState().page_cache, currentState().prefetcher
+    if prefetcher is not None and parseDate(date) is not None and FIRST_APOD_DATE <= date <= latest_date:
+        prefetcher.visit(date)  # <- warm the days around it for the next step
+    key = ('date', date, latest_date)  # <- the page also holds the latest date for the date picker
+    page = page_cache.get(key)
+    if page is None:
+        images = getImageByDate(date)
+        html = renderGallery(images, todays_date=latest_date)
+        if isErrorPage(images):
+            return html
+        page = page_cache.put(key, html, max_age=3600)
+    return page.response()
+
+# ----------------------- APOD by random count endpoint ---------------------- #
+
+@gallery.route('/random', methods=['GET'])
+def random():
+    random_count = request.args.get('random_count', default=10, type=int)
+    images = getRandomImages(random_count)
+    return renderGallery(images, todays_date=latestDate(), more_url=url_for('gallery.slides'))
+
+@gallery.route('/slides', methods=['GET'])
+def slides():
+    ''' More random slides for a running slideshow, the carousel items only (see templates/slides.html) '''
+    count = max(1, min(request.args.get('count', default=MORE_SLIDES, type=int), 20))
+    images = [image for image in getRandomImages(count) if not isErrorPage([image])]
+    return renderGallery(images, template='slides.html')
+
+# ------------------------- full text search end point ------------------------ #
+
+@gallery.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('q', default='', type=str)
+    images = searchImages(query) or [NASAImage(ERROR_IMAGE)]
+    return renderGallery(images, todays_date=latestDate(), query=query)
+
+
+# ---------------------------------------------------------------------------- #
+#                              JSON api end points                             #
+#        The same image fields as the gallery for use by other services        #
+# ---------------------------------------------------------------------------- #
+
+@gallery.route('/api/apod', methods=['GET'])
+def api_apod():
+    apod_date = request.args.get('date', type=str)
+    if apod_date is not None and parseDate(apod_date) is None:
+        # never spend the api rate limit on a date the api can only answer with an error
+        return jsonify({'error': 'date must be a YYYY-MM-DD date'}), 400
+    images = getTodaysImage() if apod_date is None else getImageByDate(apod_date)
+    if isErrorPage(images):
+        return jsonify({'error': f'No image found for date {apod_date}'}), 404
+    return jsonify(images[0].asDict())
+
+@gallery.route('/api/apod/random', methods=['GET'])
+def api_apod_random():
+    count = request.args.get('count', default=10, type=int)
+    return jsonify([image.asDict() for image in getRandomImages(count) if not isErrorPage([image])])
+
+@gallery.route('/api/apod/search', methods=['GET'])
+def api_apod_search():
+    query = request.args.get('q', default='', type=str)
+    limit = max(1, min(request.args.get('limit', default=20, type=int), 100))
+    return jsonify([image.asDict() for image in searchImages(query, limit=limit)])
+
+@gallery.route('/api/apod/range', methods=['GET'])
+def api_apod_range():
+    '''
+    Stream the images from start to end as newline delimited JSON, one image per line.
+    A page covers at most limit days starting at cursor (defaults to start). When there are
+    more days the next page is linked in the Link header and the X-Next-Cursor header.
+    When the api could not be reached for some of the days the page ends with an error line
+    holding the cursor to retry from, the days from there on are not in the page
+    '''
+    start = parseDate(request.args.get('start', type=str))
+    end = parseDate(request.args.get('end', default=latestDate(), type=str))
+    if start is None or end is None or start > end:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD dates with start before end'}), 400
+    end = min(end, parseDate(latestDate()))  # <- the api answers a range reaching into the future with an error
+    limit = max(1, min(request.args.get('limit', default=100, type=int), MAX_RANGE_PAGE_DAYS))
+    cursor = parseDate(request.args.get('cursor', type=str)) or start
+    page_start = max(cursor, start, parseDate(FIRST_APOD_DATE))
+    page_end = min(page_start + timedelta(days=limit - 1), end)
+
+    def generate():
+        try:
+            for record in getRangeRecords(page_start, page_end):
+                image = NASAImage(record)
+                if image.title != ERROR_IMAGE['title']:  # <- media_type other can not be shown
+                    yield json.dumps(image.asDict()) + '\n'
+        except IncompleteRange as error:
+            # the headers are already sent, the last line tells the consumer the page has a hole
+            # and where to continue instead of leaving the missing days out silently
+            yield json.dumps({'error': str(error), 'cursor': error.cursor}) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    if page_end < end:
+        next_cursor = (page_end + timedelta(days=1)).strftime('%Y-%m-%d')
+        next_url = url_for('gallery.api_apod_range', start=start.strftime('%Y-%m-%d'),
+                           end=end.strftime('%Y-%m-%d'), limit=limit, cursor=next_cursor)
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+# ---------------------------------------------------------------------------- #
+#                       Request timing and metrics end point                   #
+# ---------------------------------------------------------------------------- #
+
+def routeName():
+    ''' The route rule of the current request, so /date?date=... is counted as /date '''
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@gallery.before_app_request
+def startTiming():
+    g.request_start = time.perf_counter()
+    metrics.beginRequest(routeName())
+    profiler = currentState().profiler
+    if profiler is not None:
+        profiler.begin()
+
+@gallery.after_app_request
+def recordTiming(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    seconds = time.perf_counter() - start
+    route = routeName()
+    stages = metrics.endRequest(route, response.status_code, seconds)
+    profiler = currentState().profiler
+    if profiler is not None:
+        path = profiler.end(route, seconds)
+        if path is not None:
+            print(f'{route} took {seconds * 1000:.0f} ms, flame graph data written to {path}')
+    # the browser dev tools show these next to the request in the network tab
+    timings = [f'{stage};dur={stage_seconds * 1000:.1f}' for stage, stage_seconds in stages.items()]
+    response.headers['Server-Timing'] = ', '.join(timings + [f'total;dur={seconds * 1000:.1f}'])
+    return response
+
+@gallery.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
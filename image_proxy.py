@@ -0,0 +1,132 @@
+'''
+image_proxy.py serves APOD images through the gallery server instead of linking the
+browser straight to apod.nasa.gov.
+
+Original images are downloaded once and resized to the sizes the gallery actually shows
+(a carousel size and a small thumbnail) by a small pool of worker threads. The results are
+stored on local disk under the sha256 of the source url and size, APOD image urls never
+change once published so a derivative never has to be generated twice. The files are served
+with long lived cache headers and support Range and conditional requests.
+
+Resizing needs the Pillow package. Without it the original image is cached and served as is.
+'''
+
+# built in imports
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Non built in imports
+import requests as reqs
+
+# Pillow is optional, without it images are proxied and cached but not resized
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# derivative name: largest (width, height) the image is scaled down to fit
+SIZES = {'carousel': (1280, 960),
+         'thumb': (320, 240)}
+
+# only images from these hosts are proxied, the proxy must not fetch arbitrary urls.
+# Video thumbnails are hosted by youtube and vimeo
+ALLOWED_HOSTS = ('apod.nasa.gov', 'www.nasa.gov', 'img.youtube.com', 'i.ytimg.com', 'i.vimeocdn.com')
+
+# one year, a derivative never changes
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def isAllowed(src):
+    ''' True if src is an http(s) url on one of the ALLOWED_HOSTS '''
+    url = urlparse(src or '')
+    return url.scheme in ('http', 'https') and url.hostname in ALLOWED_HOSTS
+
+
+def mimetype(src):
+    ''' Return the mime type derivatives of src are served with. Derivatives are always JPEG
+    when Pillow is installed, without it the original image is served as is '''
+    if Image is not None:
+        return 'image/jpeg'
+    return mimetypes.guess_type(urlparse(src).path)[0] or 'application/octet-stream'
+
+
+class ImageProxy():
+    '''Downloads, resizes and caches images on local disk
+
+    use:
+        proxy = ImageProxy('image_cache')
+        path = proxy.derivative('https://apod.nasa.gov/apod/image/2103/x.jpg', 'carousel')
+
+    parameters:
+        cache_dir: directory derivatives are stored in, created if it does not exist
+        workers: number of threads downloading and resizing images
+        timeout: seconds to wait for the image host
+    '''
+    def __init__(self, cache_dir, workers=4, timeout=(3.05, 30)):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.generated = 0
+        self.session = reqs.Session()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-proxy')
+        self._inflight = {}  # <- derivative path: Future, so an image is only generated once at a time
+        self._lock = threading.Lock()
+
+    def path(self, src, size):
+        ''' Return the location of the derivative of src in size on disk '''
+        digest = hashlib.sha256(f'{size}:{src}'.encode('utf-8')).hexdigest()
+        # spread files over 256 sub directories so no single directory grows too large
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.jpg')
+
+    def _generate(self, src, size, path):
+        ''' Download src, resize it to size and write it to path '''
+        response = self.session.get(src, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.content
+        if Image is not None:
+            with Image.open(io.BytesIO(data)) as image:
+                image.thumbnail(SIZES[size])
+                output = io.BytesIO()
+                image.convert('RGB').save(output, format='JPEG', quality=85, optimize=True)
+                data = output.getvalue()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file and rename so a half written file is never served
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as derivative:
+            derivative.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.generated += 1
+        return path
+
+    def submit(self, src, size):
+        ''' Queue the derivative of src in size for generation and return a Future for its path '''
+        path = self.path(src, size)
+        with self._lock:
+            future = self._inflight.get(path)
+            created = future is None
+            if created:
+                future = self._inflight[path] = self._pool.submit(self._generate, src, size, path)
+        if created:
+            # added outside the lock, the callback runs straight away if the future is already done
+            future.add_done_callback(lambda done: self._forget(path))
+        return future
+
+    def _forget(self, path):
+        with self._lock:
+            self._inflight.pop(path, None)
+
+    def derivative(self, src, size, timeout=60):
+        ''' Return the path of the derivative of src in size, generating it if it is not cached yet.
+        Raises ValueError for unknown sizes or hosts and the download error if generation fails '''
+        if size not in SIZES or not isAllowed(src):
+            raise ValueError(f'Can not proxy {src} in size {size}')
+        path = self.path(src, size)
+        if os.path.exists(path):
+            return path
+        return self.submit(src, size).result(timeout=timeout)
@@ -1,17 +1,22 @@
 '''
 nasa_api.py provides functionality to query for image data from the astronomy
-picture of the day api from NASA. It aslo creates object representations of individual 
-images from the returned JSON data. The images are then displayed using a web server
-image gallery built using python, flask, jinja, html, css, and bootstrap.
+picture of the day api from NASA. Object representations of individual images are
+created from the returned JSON data (see apod_image.py). The images are then displayed using
+a web server image gallery built using python, flask, jinja, html, css, and bootstrap
+(see gallery.py and templates/nasa_gallery.html).
 
-Running this program will create a template directory in the directory from which it is run.
-The template directory will contain a single html template file created from running this program.
-The webserver and gallery will then be started with an initial query for 15 random images.
+Running this program starts the webserver and gallery with an initial query for 15 random images.
 controls are provided in the interface to query for todays image, for a specific days
 image, or n number of random images between 1-20 inclusive.
 
-This was originally 3 separate files and really should be. The program was combined to 
-a single file for ease of assignment submittal and marking.
+    python nasa_api.py                  start the gallery and open a web browser
+    python nasa_api.py --check-deps     check for missing dependencies before starting
+    python nasa_api.py --workers 4      production mode, 4 worker processes sharing the record cache
+    python nasa_api.py --profile-slow 1 write flame graph data of requests slower than a second
+    python nasa_api.py --help           list all options
+
+Importing this module has no side effects. init() opens the local record cache and creates
+the api client, gallery.create_app() calls it for you.
 
 Assignment details
 CSD-3444 Emerging Technologies
@@ -22,85 +27,25 @@ Date: March 13 ,2021
 '''
 
 # built in imports
+import argparse
+import importlib.metadata
 import os
-import sys
 import subprocess
-import json
+import sys
 import webbrowser as wb
-import requests as reqs
-from datetime import datetime, date
+from datetime import datetime, timedelta
 from threading import Timer
-# colorama is a simple cross-platform API for printing colored terminal text from Python
-# colorama is not listed as built in but I did not have to istall it, so it appears to be
-# installed by default with python? Or maybe vs code installed it? 
-# I am only using it in the automated dependency handling section.
-# If colorama causes issues. Please follow the instructions listed below to comment out
-from colorama import Fore 
-from colorama import Style
-
-# ---------------------------------------------------------------------------- #
-#     Terry, I added automated dependency handling just to see if I could.     #
-#    It will only function in machines with pip installed and i am not sure    #
-#         how  it will react in machines with multiple versions of pip.        #
-#             If it causes errors when you try to run this program             #
-#                   please comment out from here (lines 50-95)                 #
-# ---------------------------------------------------------------------------- #
-
-# build list of pip installed packages
-pip_list = subprocess.getoutput([sys.executable, '-m', 'pip', 'list'])
-'''
-pip_list will be a single string formated like below
-'Package             Version\n------------------- ---------\pkgname             pkgversion\n...
-to store just the package names split pip_list by \n keeping all but first 2 items,
-split each item in list keeping only the first item in lower case
-'''
-avail_packages = [item.split()[0].lower()  for item in pip_list.split('\n')][2:]
-
-# List of dependencies that may need to be installed (not builtin)
-dependencies = ['flask'] # enter dependencies in lower case
-
-missing_dependencies = []  # <- missisng dependencies will be added to this list
-
-print("Checking for dependencies")
-# iterate through dependencies and check if package is available for install
-for dependency in dependencies:
-    if not dependency in avail_packages:
-        missing_dependencies.append(dependency)
-
-# if there are missing dependencies, install using pip if user allows when prompted
-if len(missing_dependencies) > 0: 
-    print(f'{Fore.RED}You are missing the following dependencies {Fore.YELLOW}{missing_dependencies}{Style.RESET_ALL}')
-    install = ''
-    while install not in ['y','Y','n','N']:
-        install = input('Would you like to install them automatically with pip (y/n)? ')
-    if install in ['y','Y']:
-        for dependency in missing_dependencies:
-            try:
-                '''
-                The first method I used to install modules worked in this application but is not threadsafe
-                and is intended to be run as a single process. It is also not supported by PyPA
-                pip.main(['install', dependency])  
-                Running pip as a SubProcess is however fully supported by PyPA
-                '''
-                subprocess.check_call([sys.executable, '-m', 'pip', 'install', dependency])
-                missing_dependencies.remove(dependency) # any dependency install that raises an exception will not be removed
-            except:
-                print(f'Could not install module {dependency}')
-  
-# If there are still missing modules, notify user and quit program 
-if len(missing_dependencies) > 0:
-    print(f'{Fore.RED}please manually install {missing_dependencies} before running program again.{Style.RESET_ALL}')
-    quit()
-
-print("All dependencies are installed, continuing with module imports")
-
-# ---------------------------------------------------------------------------- #
-#                                    to here                                   #
-# ---------------------------------------------------------------------------- #
 
 # Non built in imports
-from flask import Flask, render_template, request
+import requests as reqs
 from nasa_key import NASA_KEY
+from apod_image import NASAImage, ERROR_IMAGE, parseImages
+from apod_client import APODClient
+from apod_budget import RateBudget, INTERACTIVE
+from apod_cache import APODCache
+from apod_sampler import RandomSampler
+from apod_refresher import TodayRefresher
+from apod_search import SearchIndex
 
 # ---------------------------------------------------------------------------- #
 #                Interact with API and create NASAImage objects                #
@@ -109,338 +54,368 @@ from nasa_key import NASA_KEY
 # API Key for nasa apis
 API_KEY = NASA_KEY
 
+# Several keys can be listed as NASA_KEYS in nasa_key.py, the api calls are spread over them
+try:
+    from nasa_key import NASA_KEYS
+except ImportError:
+    NASA_KEYS = [API_KEY]
+
 # base url for APOD (Astronomy Picture of the Day)
 # documentation @ https://github.com/nasa/apod-api
 baseUrl = 'https://api.nasa.gov/planetary/apod'
 
-todays_date = str(datetime.today().date().strftime('%Y-%m-%d'))
+# first date available from the APOD api
+FIRST_APOD_DATE = '1995-06-16'
 
-# definition of image to return when an error occurs parsing JSON data return from api
-ERROR_IMAGE = {'media_type':'image',
-               'title':'Error: Not Found',
-               'date':todays_date,
-               'url':'https://www.nasa.gov/sites/default/files/2cntrl_0.jpg',
-               'explanation':'We are looking hard but could not find the requested image'}
+HERE = os.path.dirname(os.path.abspath(__file__))
 
+# NASAImage and the ERROR_IMAGE definition live in apod_image.py
 
-class NASAImage():
-    '''Creates a NASA Astonomy Picture of the Day object for a single image
+# The rate limit budget, api client, record cache, search index, random sampler and todays
+# image refresher are created by init(), nothing is opened or started when this module is imported
+api_budget = None
+apod_client = None
+apod_cache = None
+search_index = None
+random_sampler = None
+today_refresher = None
 
-    use:    
-        NASAImage(json_data) 
+# (cache path, api url) init() was called with, every app of the process shares them
+settings = None
 
-    parameters: 
-        json_data: The json data returned by NASA APOD api for a single image
+def init(cache_path=None, api_url=None):
     '''
-    def __init__(self, json_data):
-        # medoa_type key is sometimes missing is data and sometimes datatype is other 
-        # both are not compatible with the gallery. Return an error image.
-        if 'media_type' not in json_data.keys() or json_data['media_type'] == 'other':
-            # self.copyright = self.date = self.url = self.hdurl = self.explanation = None
-            # self.title = 'No Image fount for requested date'
-            json_data = ERROR_IMAGE
-
-        # copyright data is only available on some images
-        try:
-            self.copyright = json_data['copyright']
-        except KeyError:
-            self.copyright = "Not Available"
-        
-        self.title = json_data['title']
-        self.date = json_data['date']
-        # if we get this far and the media_type is not image then it is video. 
-        # videos have a thumbnail_url key that can be used inplace of url key
-        if json_data['media_type'] == 'image':
-            self.url = json_data['url']
-        else:
-            self.url = json_data['thumbnail_url']
-        # Some responses do not include an hdurl. In these cases replace hdurl with url
-        try:
-            self.hdurl = json_data['hdurl']
-        except KeyError:
-            self.hdurl = self.url
-        self.explanation = json_data['explanation']
+    Create the api client and open the local record cache. Calling init again with the same
+    settings does nothing, calling it with a different cache path or api url raises ValueError:
+    the record cache and the api client are shared by every app in the process.
+
+    parameters:
+        cache_path: location of the SQLite record cache, defaults to apod_cache.sqlite3 next to this file
+        api_url: APOD api url to use instead of baseUrl, for example a local stub server
+    '''
+    global api_budget, apod_client, apod_cache, search_index, random_sampler, today_refresher, baseUrl, settings
+    requested = (os.path.abspath(cache_path or os.path.join(HERE, 'apod_cache.sqlite3')), api_url or baseUrl)
+    if settings is not None:
+        if requested != settings:
+            raise ValueError(f'init was already called with cache {settings[0]} and api {settings[1]}, '
+                             f'it can not switch to cache {requested[0]} and api {requested[1]}')
+        return
+    settings = requested
+    cache_path, baseUrl = requested
+    # A published APOD record never changes, so every record we receive is kept in a local
+    # SQLite file next to this program. See apod_cache.py for details.
+    apod_cache = APODCache(cache_path)
+    # The api only allows so many calls an hour per key. The budget follows what is left,
+    # keeps the last of it for visitors and picks the key of every call. It is kept in the
+    # record cache so every worker process spends the same budget. See apod_budget.py
+    api_budget = RateBudget(NASA_KEYS, cache=apod_cache)
+    # Every api call shares one pooled, retrying client. See apod_client.py for details.
+    apod_client = APODClient(budget=api_budget)
+    # full text search over every cached record. See apod_search.py for details.
+    search_index = SearchIndex(apod_cache)
+    search_index.update()  # <- index what was stored since the last run, not on the first search
+    # random dates are picked from the cached records once enough of them are stored.
+    # Running apod_ingest.py fills the cache with the whole archive
+    random_sampler = RandomSampler(apod_cache)
+    # Todays image is kept warm in memory by a background thread that follows the date
+    # as it rolls over at midnight. The thread is started by gallery.create_app.
+    # See apod_refresher.py for details. Nobody waits for the background refresh, so it only
+    # calls the api while there is budget to spare. A visitor waiting on a cold start refreshes
+    # at interactive priority instead, see getTodaysImage
+    today_refresher = TodayRefresher(fetchRecordByDate)
+
+def getRecords(request_url, coalesce=True, priority=INTERACTIVE):
+    '''
+    Make api call to NASA and return the JSON data as a list of dict
+    Concurrent calls for the same request_url share a single api call unless coalesce is False
+    The api key is added by the client, calls nobody is waiting for should pass priority=BACKGROUND
+    '''
+    try:
+        data = apod_client.get(request_url, coalesce=coalesce, priority=priority)
+    except (reqs.RequestException, ValueError):
+        # the api could not be reached or did not return JSON, return an error image
+        return [ERROR_IMAGE]
+
+    # print(json.dumps(data, indent=4))  # NOTE: Useful for debugging purposes
+
+    '''
+    items in data that are type str are bad JSON, replace with error image.
+    '''
+    # This here is where we replace the evil bad JSON
+    return [ERROR_IMAGE if isinstance(item, str) else item for item in data]
 
 def getImages(request_url):
     '''
     Make api call to NASA and return a list of NASAImage objects
     '''
-    response = reqs.get(request_url) 
-    data = response.json() 
+    return parseImages(getRecords(request_url))
 
-    # print(json.dumps(data, indent=4))  # NOTE: Useful for debugging purposes
 
+# ---------------------------------------------------------------------------- #
+#                   Cache APOD records by date on local disk                   #
+# ---------------------------------------------------------------------------- #
+
+def cacheRecords(records):
+    ''' Store records in the cache. ERROR_IMAGE is not a real record so leave it out '''
+    apod_cache.putMany([record for record in records if record is not ERROR_IMAGE])
+
+def getCachedImages(apod_date, request_url):
     '''
-    Individual image responses are dict, multiple image responses are a list of dict
-    Put data in a list if type is dict to play nice with NASAImage class
-    items in data that are type str are bad JSON, replace with error image. 
+    Return a list of NASAImage objects for apod_date from the cache.
+    On a cache miss make the api call with request_url and cache the returned records
     '''
-    if isinstance(data, dict):
-        data = [data]
-    for item in data:
-        if isinstance(item, str):
-            item = ERROR_IMAGE  # <- This here is where we replace the evil bad JSON
-    
-    return [NASAImage(photo) for photo in data]
-    
+    record = apod_cache.get(apod_date)
+    if record is not None:
+        return parseImages([record])
+    records = getRecords(request_url)
+    cacheRecords(records)
+    return parseImages(records)
+
+def searchImages(text, limit=20):
+    ''' Return NASAImage objects for the cached records best matching text. Never calls the api '''
+    return parseImages(search_index.search(text, limit=limit))
+
 
 # ---------------------------------------------------------------------------- #
 #              create request strings for different request types              #
 # ---------------------------------------------------------------------------- #
-''' 
-available api parameters 
+'''
+available api parameters
 date: a string in YYYY-MM-DD format. Use to get APOD for a specific date
 start_date: a string in YYYY-MM-DD format. Use as a start date for a range of APOD's
 end_date: a string in YYYY-MM-DD format. Use in conjunction with start date for a range of APOD's defaults to today
 count: a positive integer no greater than 100. Use to get a random selection of images
 thumbs: a boolian value. When true API returns URL of video thumbnail. If an APOD is not video this is ignored
-api_key: string value of a valid api key must be used with request
+api_key: string value of a valid api key must be used with request. Added by apod_client, which picks one of NASA_KEYS
 '''
 
+def fetchRecordByDate(apod_date, priority=INTERACTIVE):
+    ''' Return the record dict for apod_date from the cache or the api, or None if the
+    api has no image for that date (todays image is not published until some time after midnight) '''
+    record = apod_cache.get(apod_date)
+    if record is None:
+        completeUrl = f'{baseUrl}?date={apod_date}&thumbs=true'
+        records = getRecords(completeUrl, priority=priority)
+        cacheRecords(records)
+        record = records[0] if records else ERROR_IMAGE
+    if record is ERROR_IMAGE or record.get('date') != apod_date:
+        return None
+    return record
+
 def getTodaysImage():
-    ''' Create request string for todays image. Will return json for only a single file '''
-    completeUrl = f'{baseUrl}?api_key={API_KEY}&date={todays_date}&thumbs=true'
-    return getImages(completeUrl)
+    ''' Return todays image from the warm copy kept by today_refresher. Until todays APOD
+    is published the most recent published image is returned '''
+    record = today_refresher.record()
+    if record is None:
+        record = today_refresher.refresh(INTERACTIVE)  # <- nothing warm yet, wait for the first fetch
+    return [NASAImage(record if record is not None else ERROR_IMAGE)]
 
 def getRandomImages(count=15):
     ''' Create request string for n number of images. Max supported by NASA api = 100
     max = 20, min = 1
-    type validation handled by server: if not an integer value a default of 10 is used'''
+    type validation handled by server: if not an integer value a default of 10 is used
+    Random dates are picked locally from the cache when it holds enough records,
+    only dates missing from the cache are requested from the api'''
     count = max(1,min(count, 20))
-    completeUrl = f'{baseUrl}?api_key={API_KEY}&count={count}&thumbs=true'
-    return getImages(completeUrl)
+    random_dates = random_sampler.sample(count)
+    if random_dates is None and not api_budget.allows(INTERACTIVE):
+        # the api rate limit is used up, show what the cache holds (maybe fewer images) instead of an error image
+        random_dates = random_sampler.sample(count, partial=True)
+    if random_dates is not None:
+        return [image for apod_date in random_dates for image in getImageByDate(apod_date)]
+
+    completeUrl = f'{baseUrl}?count={count}&thumbs=true'
+    records = getRecords(completeUrl, coalesce=False)  # <- every visitor gets their own random images
+    cacheRecords(records)  # <- random records are real records too, keep them for later
+    return parseImages(records)
 
 def getImageByDate(apod_date):
     ''' Create request string for APOD for a specific date
-    min = 1995-06-16, max = today 
+    min = 1995-06-16, max = today
     entering an out of range or poorly formated date will not break the program
     NASA APOD api will just return error code and this program will return an error image
     Client side validation recomended to prevent selection of out of range date (included in this program) '''
-    completeUrl = f'{baseUrl}?api_key={API_KEY}&date={apod_date}&thumbs=true'
-    return getImages(completeUrl)
+    apod_date = normalizeDate(apod_date)  # <- 2020-1-5 is cached as 2020-01-05
+    completeUrl = f'{baseUrl}?date={apod_date}&thumbs=true'
+    return getCachedImages(apod_date, completeUrl)
 
 
 # ---------------------------------------------------------------------------- #
-#               Set up templates folder and gallery html document              #
+#                       Stream a range of dates in windows                     #
 # ---------------------------------------------------------------------------- #
-gallery_html = """
-<html>
-<head>
-    <link rel="stylesheet" 
-          href="https://maxcdn.bootstrapcdn.com/bootstrap/4.0.0/css/bootstrap.min.css"
-          integrity="sha384-Gn5384xqQ1aoWXA+058RXPxPg6fy4IWvTNh0E263XmFcJlSAwiGgFAW/dAiS6JXm" crossorigin="anonymous">
-    <!-- I would normally create separate .css file for custom css but I wanted to keep this submittal simple -->
-    <style>
-        /* set max width so main content does not distort */
-        .inner-main {
-            max-width: 1000px;
-        }
-        /* Customize carousel */
-        #carousel {
-            height: 60%;
-        }
-        .carousel-item{
-            height: 100%;
-            overflow: hidden;
-        }
-        .carousel-item img{
-            width: 100%;
-            height: 100%;
-            object-fit: scale-down;
-        }
-        /* Customize carousel previous and next icons */
-        #carousel > a.carousel-control-prev > span.carousel-control-prev-icon {
-            background-image: url("data:image/svg+xml,%3csvg xmlns='http://www.w3.org/2000/svg' fill='%2367f3f3' width='8' height='8' viewBox='0 0 8 8'%3e%3cpath d='M5.25 0l-4 4 4 4 1.5-1.5L4.25 4l2.5-2.5L5.25 0z'/%3e%3c/svg%3e");
-        }
-        
-        #carousel > a.carousel-control-next > span.carousel-control-next-icon {
-            background-image: url("data:image/svg+xml,%3csvg xmlns='http://www.w3.org/2000/svg' fill='%2367f3f3' width='8' height='8' viewBox='0 0 8 8'%3e%3cpath d='M2.75 0l-1.5 1.5L3.75 4l-2.5 2.5L2.75 8l4-4-4-4z'/%3e%3c/svg%3e");
-        }
-        /* Customize carousel indicators - defaults are not visible on white background*/
-        /* the style below makes them visible on both light and dark backgrounds */
-        .carousel-indicators li {
-            height: 10px;
-            background-color: #ffffff;
-            border-style: solid;
-            border-color: #494949;
-            border-width: 2px;
-        }
-        .carousel-indicators .active {
-            height: 10px;
-            background-color: #67f3f3;
-            border-style: solid;
-            border-color: #494949;
-            border-width: 2px;
-        }
-        /* customize carousel caption */
-        .carousel-caption {
-            top: 0;
-            bottom: 40px;
-            left: 10%;
-            right: 10%;
-            overflow: auto;
-        }
-        /* Hide title and caption information */
-        #show, #show * {
-            display: none;
-        }
-        /* Show title and caption information on hover */
-        .carousel-item:hover #show * {
-            display: block;
-        }
-        .carousel-item:hover #show {
-            background-color: rgba(0, 0, 0, 0.8);
-        }
-
-    </style>
-    <title>Shawn's Simple NASA Photo Gallery NASA Photo Gallery</title>
-</head>
-<body>
-    <header>
-        <nav class="navbar navbar-light bg-light">
-            <div class="container-fluid">
-                <form action="/today">
-                    <button type="submit" class="btn btn-outline-info">Get Today's APOD</button>
-                </form>
-                <form action="/date" method="GET">
-                    <input class="date" type="date" id="date" min="1995-06-16" max="{{todays_date}}" name="date">
-                    <button type="submit" class="btn btn-outline-info">Get APOD by Date</button>
-                </form>
-                <form class="d-flex" action="/random" method="GET">
-                    <input type="number" class="form-control me-2" name="random_count" min=1 max=20 placeholder="Quantity" aria-label="Quantity">
-                    <button type="submit" class="btn btn-outline-info">Get Random</button>
-                </form>
-            </div>
-          </nav>
-    </header>
-    <main class="mx-5">
-    <div class="mx-auto inner-main"> 
-        <h1 class="text-center">Shawn's NASA APOD Photo Gallery</h1>
-        <h5 class="text-center">These images are from the <a href="https://apod.nasa.gov/apod/astropix.html">NASA Astronomy Picture of the Day Webite</a></h5>
-        
-<!-- ----------------------------------------------------------------------- -->
-<!--                           Bootstap Carousel                             -->
-<!--                     Integrated with Flask and Jinja                     -->
-<!-- ----------------------------------------------------------------------- -->
-
-        <div id="carousel" class="carousel slide" data-ride="carousel">
-            <ol class="carousel-indicators">
-                <!-- for each image add a carousel indicator. For the first, add class active  -->
-                {% for image in images %}
-                    {% if loop.first %} <!-- loop.first evaluates true only on first loop -->
-                        <li data-target="#carousel" data-slide-to="0" class="active"></li>
-                    {% else %}
-                        <li data-target="#carousel" data-slide-to={{loop.index0}}></li> <!-- loop.index is 1 based indexing and loop.index0 is 0 based indexing -->
-                    {% endif %}
-                {% endfor %}
-            </ol>
-            <div class="carousel-inner">
-                {% for image in images %}
-                    {% if loop.first %}
-                        <div class="carousel-item active">
-                    {% else %}
-                        <div class="carousel-item">
-                    {% endif %}
-                    <img class="d-block w-100" src={{image.url}} alt={{image.url}}>
-                    <div id="show" class="carousel-caption d-none d-md-block p-2">
-                        <h5 >{{ image.title }}</h5>
-                        <p>Date: {{image.date}} <br> Copyright: {{image.copyright}}
-                        <p>{{ image.explanation }}</p>
-                        <a href={{image.hdurl}} target="_blank">Link to highest resolution version of this image available from NASA.</a>
-                    </div>
-                    </div>
-                {% endfor %}
-            </div>
-            <a class="carousel-control-prev" href="#carousel" role="button" data-slide="prev">
-                <span class="carousel-control-prev-icon" aria-hidden="true"></span>
-                <span class="sr-only">Previous</span>
-            </a>
-            <a class="carousel-control-next" href="#carousel" role="button" data-slide="next">
-                <span class="carousel-control-next-icon" aria-hidden="true"></span>
-                <span class="sr-only">Next</span>
-            </a>
-        </div>
-        <p class="text-center">Mouse over image to pause slideshow and see image title and description</p>
-    </div>
-</main>
-
-    <script src="https://code.jquery.com/jquery-3.2.1.slim.min.js"
-        integrity="sha384-KJ3o2DKtIkvYIK3UENzmM7KCkRr/rE9/Qpg6aAZGJwFDMVNA/GpGFF93hXpG5KkN" crossorigin="anonymous">
-        </script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/popper.js/1.12.9/umd/popper.min.js"
-        integrity="sha384-ApNbgh9B+Y1QKtv3Rn7W3mgPxhU9K/ScQsAP7hUibX39j7fakFPskvXusvfa0b4Q" crossorigin="anonymous">
-        </script>
-    <script src="https://maxcdn.bootstrapcdn.com/bootstrap/4.0.0/js/bootstrap.min.js"
-        integrity="sha384-JZR6Spejh4U02d8jOt6vLEHfe/JQGiRRSQQxSfFWpi1MquVdAyjUar5+76PVCmYl" crossorigin="anonymous">
-        </script>
-
-</body>
-
-</html>
-"""
-
-os.chdir(sys.path[0])  # ensure we are working in the directory this file was executed from
-
-# ---------- create templates directory if it does not already exist --------- #
-
-if not os.path.exists("templates"):  # Check if directory exists
-            os.mkdir("templates")  # Make directory
-
-# ----- open nasa_gallery.html and write gallery_html string to the file ----- #
-# ------------------------- whether it exists or not ------------------------- #
-
-with open('./templates/nasa_gallery.html', 'w') as gallery:
-    gallery.write(gallery_html)
+
+# number of days read from the cache or requested from the api at a time when streaming a range
+RANGE_WINDOW_DAYS = 31
+
+def parseDate(value):
+    ''' Return value as a date or None if it is not a YYYY-MM-DD string '''
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def normalizeDate(value):
+    ''' Return value as a zero padded YYYY-MM-DD string, the way the api and the cache write
+    dates, or unchanged if it is not a date '''
+    parsed = parseDate(value)
+    return parsed.strftime('%Y-%m-%d') if parsed is not None else value
+
+class IncompleteRange(Exception):
+    ''' Raised by getRangeRecords when the api call for a window failed. Every record before
+    cursor (a YYYY-MM-DD date) has been yielded, a retry should start at cursor '''
+    def __init__(self, cursor):
+        super().__init__(f'The records from {cursor} on could not be requested from the api')
+        self.cursor = cursor
+
+def getRangeRecords(start, end, priority=INTERACTIVE):
+    '''
+    Generator of the records from start to end inclusive (dates) in date order.
+    Records are read from the cache a window of days at a time, only the dates missing
+    from the cache are requested from the api. Memory use does not grow with the range.
+    Raises IncompleteRange when the api call for a window fails instead of leaving out its days
+    '''
+    while start <= end:
+        window_end = min(start + timedelta(days=RANGE_WINDOW_DAYS - 1), end)
+        window_start_date, window_end_date = start.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')
+        records = apod_cache.getRange(window_start_date, window_end_date)
+        # APOD skipped a few days in its early years, those dates are simply missing in the api response.
+        # They are remembered as gaps so they are not requested again on every range request
+        gaps = apod_cache.getGaps(window_start_date, window_end_date)
+        missing = [day.strftime('%Y-%m-%d') for day in (start + timedelta(days=offset)
+                                                          for offset in range((window_end - start).days + 1))]
+        missing = [apod_date for apod_date in missing if apod_date not in records and apod_date not in gaps]
+        if missing:
+            completeUrl = f'{baseUrl}?start_date={missing[0]}&end_date={missing[-1]}&thumbs=true'
+            response = getRecords(completeUrl, priority=priority)
+            fetched = [record for record in response if record is not ERROR_IMAGE]
+            cacheRecords(fetched)
+            records.update((record['date'], record) for record in fetched if 'date' in record)
+            if len(fetched) != len(response):  # <- the call failed, its days are not gaps
+                for apod_date in sorted(records):
+                    if window_start_date <= apod_date < missing[0]:
+                        yield records[apod_date]
+                raise IncompleteRange(missing[0])
+            apod_cache.putGaps(apod_date for apod_date in missing if apod_date not in records)
+        for apod_date in sorted(records):
+            if window_start_date <= apod_date <= window_end_date:
+                yield records[apod_date]
+        start = window_end + timedelta(days=1)
 
 
 # ---------------------------------------------------------------------------- #
-#                  Start gallery server and launch web browser                 #
-#   Note: this server will not scale well and is not designed for deployment   #
+#                      Optional automated dependency handling                  #
+#          Only runs when the program is started with --check-deps             #
 # ---------------------------------------------------------------------------- #
 
-# Create Flask instance
-app = Flask(__name__)
-
-app.config['DEBUG'] = False  # Set true for live updates when editing code
-# Note: Two browser tabs will open when this program is run if DEBUG is set True. 
-
-
-# ----------------------------- default end point ---------------------------- #
-
-@app.route('/', methods=['GET'])
-def home():
-    images = getRandomImages(15)
-    return render_template('nasa_gallery.html', images=images, todays_date=todays_date)
-
-# -------------------------- APOD for today endpoint ------------------------- #
-
-@app.route('/today', methods=['GET'])
-def today():
-    images = getTodaysImage()
-    return render_template('nasa_gallery.html', images=images, todays_date=todays_date)
-
-# --------------------------- APOD by date endpoint -------------------------- #
+# List of dependencies that may need to be installed (not builtin)
+# requests is not listed: this module imports it at the top, so without it the check never runs
+dependencies = ['flask'] # enter dependencies in lower case
 
-@app.route('/date', methods=['GET'])
-def date():
-    date = request.args.get('date', type=str)
-    images = getImageByDate(date)
-    return render_template('nasa_gallery.html', images=images, todays_date=todays_date)
+def missingDependencies():
+    ''' Return the dependencies that are not installed. Reads the installed package metadata
+    instead of running pip list, so it takes milliseconds instead of seconds '''
+    missing_dependencies = []  # <- missisng dependencies will be added to this list
+    for dependency in dependencies:
+        try:
+            importlib.metadata.version(dependency)
+        except importlib.metadata.PackageNotFoundError:
+            missing_dependencies.append(dependency)
+    return missing_dependencies
 
-# ----------------------- APOD by random count endpoint ---------------------- #
+def checkDependencies():
+    '''
+    Check for missing dependencies and install them using pip if the user allows when prompted.
+    Returns True if all dependencies are installed
+    '''
+    # colorama is only used to color the messages below, plain text is fine without it
+    try:
+        from colorama import Fore, Style
+        red, yellow, reset = Fore.RED, Fore.YELLOW, Style.RESET_ALL
+    except ImportError:
+        red = yellow = reset = ''
+
+    print("Checking for dependencies")
+    missing_dependencies = missingDependencies()
+
+    # if there are missing dependencies, install using pip if user allows when prompted
+    if len(missing_dependencies) > 0:
+        print(f'{red}You are missing the following dependencies {yellow}{missing_dependencies}{reset}')
+        install = ''
+        while install not in ['y','Y','n','N']:
+            install = input('Would you like to install them automatically with pip (y/n)? ')
+        if install in ['y','Y']:
+            for dependency in list(missing_dependencies):
+                try:
+                    # Running pip as a SubProcess is fully supported by PyPA
+                    subprocess.check_call([sys.executable, '-m', 'pip', 'install', dependency])
+                    missing_dependencies.remove(dependency) # any dependency install that raises an exception will not be removed
+                except subprocess.CalledProcessError:
+                    print(f'Could not install module {dependency}')
+
+    # If there are still missing modules, notify user
+    if len(missing_dependencies) > 0:
+        print(f'{red}please manually install {missing_dependencies} before running program again.{reset}')
+        return False
+    print("All dependencies are installed")
+    return True
 
-@app.route('/random', methods=['GET'])
-def random():
-    random_count = request.args.get('random_count', default=10, type=int)
-    images = getRandomImages(random_count)
-    return render_template('nasa_gallery.html', images=images, todays_date=todays_date)
 
+# ---------------------------------------------------------------------------- #
+#                  Start gallery server and launch web browser                 #
+#   Note: the default server will not scale well and is not designed for       #
+#   deployment, use --workers to serve with several processes                  #
+# ---------------------------------------------------------------------------- #
 
-def openb():
+def openb(url='http://localhost:5000'):
     ''' Opens a webbrowser to port 5000 on localhost '''
-    wb.open('http://localhost:5000')
-
-# Wait 2 second before opening web browser to give server time to start
-Timer(2, openb).start()
-
-app.run()
+    wb.open(url)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shawn's NASA APOD Photo Gallery")
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=5000, help='port to listen on')
+    parser.add_argument('--no-browser', action='store_true', help='do not open a web browser')
+    parser.add_argument('--check-deps', action='store_true',
+                        help='check for missing dependencies and offer to install them first')
+    # Note: Two browser tabs will open when this program is run with --debug
+    parser.add_argument('--debug', action='store_true', help='live updates when editing code')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='production mode: serve with this many worker processes sharing the record '
+                             'cache, 0 (the default) runs the single process development server')
+    parser.add_argument('--cache', default=os.path.join(HERE, 'apod_cache.sqlite3'), help='record cache file')
+    parser.add_argument('--image-cache', default=os.path.join(HERE, 'image_cache'),
+                        help='directory resized images are stored in')
+    parser.add_argument('--api-url', default=baseUrl, help='APOD api url, for example a local stub server')
+    parser.add_argument('--prefetch-days', type=int, default=3,
+                        help='after a date lookup warm this many days on either side of it, 0 to disable')
+    parser.add_argument('--profile-slow', type=float, default=None, metavar='SECONDS',
+                        help='write flame graph data of requests slower than SECONDS to the profiles directory')
+    args = parser.parse_args(argv)
+
+    if args.check_deps and not checkDependencies():
+        return 1
+
+    # imported here so a missing flask is reported by --check-deps above instead of an ImportError
+    from gallery import create_app
+    config = {'DEBUG': args.debug,
+              'APOD_CACHE_PATH': args.cache,
+              'IMAGE_CACHE_DIR': args.image_cache,
+              'APOD_API_URL': args.api_url,
+              'PREFETCH_DAYS': args.prefetch_days,
+              'PROFILE_SLOW_REQUESTS': args.profile_slow}
+
+    if not args.no_browser:
+        # Wait 2 second before opening web browser to give server time to start
+        Timer(2, openb, args=(f'http://localhost:{args.port}',)).start()
+
+    if args.workers > 0:
+        # every worker process creates its own app, see apod_server.py
+        from apod_server import serve
+        serve(lambda: create_app(config), host=args.host, port=args.port, workers=args.workers)
+    else:
+        create_app(config).run(host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,4 @@
-NASA_KEY = 'your key goes here'
+NASA_KEY = 'your key goes here'
+
+# Optional: more keys to spread the api calls over, each key has its own hourly rate limit
+# NASA_KEYS = [NASA_KEY, 'your second key goes here']
@@ -0,0 +1,107 @@
+'''
+page_cache.py keeps rendered gallery pages in memory so deterministic routes (an APOD for a
+given date, today's APOD) do not render the template or call the api again.
+
+Each page is stored as is and pre-compressed with gzip, and with brotli when the brotli
+package is installed. Pages are answered with an ETag and Last-Modified header so a browser
+that already has the page gets a 304 Not Modified without a body.
+'''
+
+# built in imports
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Non built in imports
+from flask import Response, request
+
+# brotli is optional, without it pages are only compressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CachedPage():
+    '''A rendered page with its compressed variants and validators
+
+    parameters:
+        html: the rendered page
+        ttl: seconds the page is fresh, None if it never expires
+        max_age: seconds browsers may use the page without revalidating
+    '''
+    def __init__(self, html, ttl=None, max_age=0):
+        body = html.encode('utf-8')
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=5)
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = time.time()
+        self.expires = None if ttl is None else self.last_modified + ttl
+        self.max_age = max_age
+
+    def isFresh(self):
+        return self.expires is None or self.expires > time.time()
+
+    def response(self):
+        ''' Build the response for the current flask request. The smallest variant the browser
+        accepts is sent. Matching If-None-Match or If-Modified-Since headers get a 304 '''
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in self.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        response = Response(self.variants[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        # the variants are the same page, so they share one weak ETag
+        response.set_etag(self.etag, weak=True)
+        response.last_modified = self.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
+
+
+class PageCache():
+    '''LRU cache of rendered pages keyed by route and parameters
+
+    use:
+        page = page_cache.get(('date', apod_date))
+        if page is None:
+            page = page_cache.put(('date', apod_date), render_template(...))
+        return page.response()
+
+    parameters:
+        max_pages: maximum number of pages kept in memory
+    '''
+    def __init__(self, max_pages=512):
+        self.max_pages = max_pages
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        ''' Return the cached page for key or None if it is not cached or has expired '''
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page.isFresh():
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+            self.misses += 1
+            return None
+
+    def put(self, key, html, ttl=None, max_age=0):
+        ''' Compress and store html for key and return the CachedPage '''
+        page = CachedPage(html, ttl=ttl, max_age=max_age)
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return page
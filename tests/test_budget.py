@@ -0,0 +1,43 @@
+'''
+Tests of the api rate limit budget shared by worker processes.
+
+    python -m pytest tests
+'''
+
+# built in imports
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from apod_cache import APODCache
+from apod_budget import RateBudget, INTERACTIVE, BACKGROUND
+
+
+class SharedBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'apod_cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_workers_spend_the_same_budget(self):
+        # every worker opens its own cache and budget on the same database file
+        first, second = (RateBudget(['key'], cache=APODCache(self.path), limit=10) for _ in range(2))
+        for _ in range(8):
+            self.assertEqual(first.acquire(BACKGROUND), 'key')
+        self.assertEqual(second.remaining(), 2)
+        self.assertIsNone(second.acquire(BACKGROUND))  # <- the reserve is kept for visitors
+        self.assertEqual(second.acquire(INTERACTIVE), 'key')
+        second.update('key', 429, {})
+        self.assertFalse(first.allows(INTERACTIVE))
+
+
+if __name__ == '__main__':
+    unittest.main()
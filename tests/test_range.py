@@ -0,0 +1,122 @@
+'''
+Tests of the JSON api end points, the range windowing behind /api/apod/range and the app
+factory, run against the local stub APOD api.
+
+    python -m pytest tests
+'''
+
+# built in imports
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from stub_apod import StubAPOD
+import nasa_api
+from gallery import create_app
+
+
+def setUpModule():
+    global stub, temp_dir, config, app, client
+    stub = StubAPOD().start()
+    temp_dir = tempfile.mkdtemp()
+    config = {'APOD_CACHE_PATH': os.path.join(temp_dir, 'apod_cache.sqlite3'),
+              'IMAGE_CACHE_DIR': os.path.join(temp_dir, 'image_cache'),
+              'APOD_API_URL': stub.url,
+              'START_REFRESHER': False,
+              'PREFETCH_DAYS': 0}
+    app = create_app(config)
+    client = app.test_client()
+
+
+def tearDownModule():
+    stub.stop()
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def getLines(url):
+    response = client.get(url)
+    return response, [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+class RangeTest(unittest.TestCase):
+
+    def test_end_in_the_future_is_clamped_to_the_latest_date(self):
+        today = date.fromisoformat(nasa_api.today_refresher.latestDate())
+        start = today - timedelta(days=10)
+        # asked first, while none of the days are cached yet
+        response, until_future = getLines(f'/api/apod/range?start={start}&end={today + timedelta(days=30)}')
+        _, until_today = getLines(f'/api/apod/range?start={start}&end={today}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([image['date'] for image in until_future], [image['date'] for image in until_today])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+    def test_pages_follow_the_cursor(self):
+        response, first_page = getLines('/api/apod/range?start=2020-01-03&end=2020-01-14&limit=5')
+        self.assertEqual(len(first_page), 5)
+        self.assertEqual(response.headers['X-Next-Cursor'], '2020-01-08')
+        response, second_page = getLines('/api/apod/range?start=2020-01-03&end=2020-01-14&limit=5&cursor=2020-01-08')
+        self.assertEqual(second_page[0]['date'], '2020-01-08')
+        self.assertEqual(response.headers['X-Next-Cursor'], '2020-01-13')
+
+    def test_days_without_a_record_are_not_requested_again(self):
+        _, images = getLines('/api/apod/range?start=1995-06-16&end=1995-06-25')
+        self.assertNotIn('1995-06-17', [image['date'] for image in images])
+        calls = stub.calls
+        _, images_again = getLines('/api/apod/range?start=1995-06-16&end=1995-06-25')
+        self.assertEqual(images_again, images)
+        self.assertEqual(stub.calls, calls)
+
+    def test_a_failed_window_ends_the_page_with_an_error_line(self):
+        stub.error_rate = 1.0
+        try:
+            response, lines = getLines('/api/apod/range?start=2019-05-01&end=2019-05-05')
+        finally:
+            stub.error_rate = 0.0
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lines, [{'error': lines[-1]['error'], 'cursor': '2019-05-01'}])
+        _, lines = getLines('/api/apod/range?start=2019-05-01&end=2019-05-05')
+        self.assertEqual(lines[0]['date'], '2019-05-01')  # <- the failed days were not remembered as gaps
+
+    def test_start_after_end_is_rejected(self):
+        response = client.get('/api/apod/range?start=2020-01-10&end=2020-01-01')
+        self.assertEqual(response.status_code, 400)
+
+    def test_a_malformed_date_is_rejected_without_calling_the_api(self):
+        calls = stub.calls
+        response = client.get('/api/apod?date=garbage')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(stub.calls, calls)
+
+    def test_a_date_without_zero_padding_is_answered_from_the_cache(self):
+        client.get('/date?date=2020-01-05')
+        calls = stub.calls
+        self.assertEqual(client.get('/date?date=2020-1-5').status_code, 200)
+        response = client.get('/api/apod?date=2020-1-5')
+        self.assertEqual(response.get_json()['date'], '2020-01-05')
+        self.assertEqual(stub.calls, calls)
+
+
+class AppFactoryTest(unittest.TestCase):
+
+    def test_every_app_has_its_own_page_cache(self):
+        other_app = create_app(dict(config, IMAGE_CACHE_DIR=os.path.join(temp_dir, 'other_image_cache')))
+        self.assertIsNot(other_app.extensions['gallery'].page_cache, app.extensions['gallery'].page_cache)
+        self.assertEqual(other_app.test_client().get('/api/apod?date=2020-01-03').status_code, 200)
+
+    def test_another_record_cache_is_rejected(self):
+        with self.assertRaises(ValueError):
+            create_app(dict(config, APOD_CACHE_PATH=os.path.join(temp_dir, 'other_cache.sqlite3')))
+        with self.assertRaises(ValueError):
+            create_app(dict(config, APOD_API_URL='http://127.0.0.1:1/planetary/apod'))
+
+
+if __name__ == '__main__':
+    unittest.main()
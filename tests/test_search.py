@@ -0,0 +1,72 @@
+'''
+Tests of the full text search index over the record cache.
+
+    python -m pytest tests
+'''
+
+# built in imports
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from stub_apod import makeRecord
+from apod_cache import APODCache
+from apod_search import SearchIndex
+
+# number of worker processes building the index at the same time
+WORKERS = 4
+
+
+def buildIndex(path, start):
+    ''' What every worker does on startup, see nasa_api.init '''
+    start.wait()
+    SearchIndex(APODCache(path)).update()
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'apod_cache.sqlite3')
+        first = date(2005, 1, 1)
+        self.records = [makeRecord(first + timedelta(days=offset)) for offset in range(3000)]
+        APODCache(self.path).putMany(self.records)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_workers_starting_together_build_the_index_once(self):
+        context = multiprocessing.get_context('spawn')
+        start = context.Event()
+        workers = [context.Process(target=buildIndex, args=(self.path, start)) for _ in range(WORKERS)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join(60)
+        self.assertEqual([worker.exitcode for worker in workers], [0] * WORKERS)
+        shown = [record for record in self.records if record.get('media_type') in ('image', 'video')]
+        db = APODCache(self.path).connect()
+        self.assertEqual(db.execute('SELECT COUNT(*) FROM search_index').fetchone()[0], len(shown))
+
+    def test_a_replaced_record_replaces_its_index_row(self):
+        cache = APODCache(self.path)
+        index = SearchIndex(cache)
+        index.update()
+        record = next(record for record in self.records if record.get('media_type') == 'image')
+        cache.putMany([dict(record, title='Quasar Lighthouse')])
+        self.assertEqual([found['date'] for found in index.search('quasar lighthouse')], [record['date']])
+        rows = cache.connect().execute('SELECT COUNT(*) FROM search_index WHERE date = ?', (record['date'],))
+        self.assertEqual(rows.fetchone()[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()